@@ -156,7 +156,66 @@ PUSH_NOTIFICATIONS_SETTINGS = {
     "APNS_CERTIFICATE": "/path/to/your/certificate.pem",
 }
 
+# Notifications are delivered in batches over the APNS binary protocol (see stories2.apns).
+# host and port default to APNS_HOST and APNS_PORT above. For development, run
+# `manage.py apns_standin` and use {"host": "localhost", "port": 2195, "tls": False}.
+APNS_DELIVERY = {
+    "tls": True,
+    "timeout": 10,       # seconds to connect or write
+    "error_timeout": 1   # seconds to wait for an error response after a batch
+}
+
 FEED_WEIGHT = {
+    "mode": "gravity",   # or "hot", a time-invariant score which doesn't need update_feed
+    "half_life": 12,     # hours; used in hot mode
     "gravity": 1.5,
-    "comment_weight": 2   
+    "comment_weight": 2,
+    "tolerance": 0.01    # update_feed skips weights which would change by less than 1%
+}
+
+# The feed is served from a snapshot held in the cache. Use a shared cache backend (e.g.
+# memcached) when running several processes, so they serve the same snapshot versions.
+FEED_SNAPSHOT = {
+    "max_age": 600,      # seconds before the current snapshot is rebuilt
+    "keep": 3600         # seconds an old snapshot stays available to clients paging through it
+}
+
+# Detail responses for stories, topics, publications and categories are cached by object
+# version (see stories2.cache). The default local-memory cache works for a single process;
+# point `alias` at a shared backend in CACHES to share payloads and invalidations between
+# processes.
+OBJECT_CACHE = {
+    "alias": "default",
+    "timeout": 3600      # seconds a cached payload is kept
+}
+
+# /v2/changes serves the change sequence (see stories2.changes).
+CHANGE_FEED = {
+    "settle": 2,         # seconds a change is held back, so late-committing transactions aren't skipped
+    "keep": 7            # days `manage.py prune_changes` keeps; older clients must resync
+}
+
+# Auth token -> user resolutions are memoized per process (see profiles2.tokens)
+AUTH_TOKEN_CACHE = {
+    "size": 1024,        # most entries kept
+    "ttl": 300           # seconds an entry is trusted
+}
+
+# Push notifications are queued in an outbox and sent by `manage.py send_notifications`
+NOTIFICATION_OUTBOX = {
+    "max_attempts": 5,   # sends tried before a notification is marked failed
+    "backoff": 30,       # seconds before the first retry, doubling each time
+    "max_backoff": 3600,
+    "lease": 300,        # seconds a worker holds a claimed batch before others may retry it
+    "window": 60         # seconds new comments in a thread are collected into one push
+}
+
+# Open discussions stream new comments and counts as server-sent events (see stories2.events).
+# Each open stream holds a worker thread, so serve them from a threaded server.
+EVENT_STREAM = {
+    "heartbeat": 15,     # seconds between keep-alive comments on an idle stream
+    "max_duration": 300, # seconds before a stream ends and the client reconnects
+    "retry": 3000,       # milliseconds clients wait before reconnecting
+    "backlog": 100,      # events kept per thread for clients resuming with Last-Event-ID
+    "linger": 30         # seconds a thread's events are kept after its last stream closes
 }
@@ -57,7 +57,22 @@ flagrouter = routers.SimpleRouter()
 for r in (router2, slashless_router2):
     r.register('users', ProfileViewSet, base_name='user')
     r.register('feed', views2.FeedViewSet)
-    r.register('publications', views2.PublicationViewSet)
+    r.register('changes', views2.ChangeViewSet)
+    r.register('actions', views2.ActionViewSet, base_name='action')
+    publicationRoutes = r.register('publications', views2.PublicationViewSet)
+    publicationRoutes.register(
+        'stories',
+        views2.StoryViewSet,
+        base_name="publication-stories",
+        parents_query_lookups=['publisher']
+    )
+    categoryRoutes = r.register('categories', views2.CategoryViewSet)
+    categoryRoutes.register(
+        'stories',
+        views2.StoryViewSet,
+        base_name="category-stories",
+        parents_query_lookups=['categories']
+    )
     r.register('comments', views2.CommentViewSet)
     storyRoutes = r.register('stories', views2.StoryViewSet)
     storyRoutes.register(
@@ -73,6 +88,12 @@ for r in (router2, slashless_router2):
         base_name="topic-comments",
         parents_query_lookups=['topic']
     )
+    topicRoutes.register(
+        'stories',
+        views2.StoryViewSet,
+        base_name="topic-stories",
+        parents_query_lookups=['topics']
+    )
 
 flagrouter.register(r'flagged_comments', views2.FlaggedViewSet)
 
@@ -91,4 +112,5 @@ urlpatterns = [
     url(r'^admin/', admin.site.urls),
     
     url(r'^v2/admin/', include(flagrouter.urls)),
+    url(r'^v2/admin/cache_stats/?$', views2.CacheStatsView.as_view(), name='cache_stats'),
 ]
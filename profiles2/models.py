@@ -1,8 +1,10 @@
 from django.db import models
-from stories2.models import Publication
+from stories2.models import Publication, Comment
 from push_notifications.models import APNSDevice
 from django.dispatch import receiver
 from django.contrib.auth.models import User
+from django.utils.timezone import now
+from profiles2.tokens import token_cache
 
 class Profile(models.Model):    
     user = models.OneToOneField('auth.User', related_name='profile')
@@ -32,14 +34,31 @@ class Profile(models.Model):
 @receiver(models.signals.post_save, sender=Profile)
 def post_save(sender, instance, **kwargs):
     "Saves related user and keeps user's APNS device synced with profile, if exists"
+    renamed = instance.user.username != instance.username
     instance.user.username = instance.username
     instance.user.save()
+    if renamed: # Comments show their author's username
+        Comment.objects.filter(author_id=instance.user_id).update(updated_at=now())
 
     if instance.device_token:
         try:
             device = APNSDevice.objects.get(user=instance.user)
-            device.registration_id = instance.device_token
-            device.save()
+            if device.registration_id != instance.device_token:
+                device.registration_id = instance.device_token
+                device.active = True
+                device.save()
         except APNSDevice.DoesNotExist:
             device = APNSDevice(user=instance.user, registration_id=instance.device_token)
             device.save()
+
+@receiver(models.signals.post_save, sender=Profile)
+@receiver(models.signals.post_delete, sender=Profile)
+def forget_auth_token(sender, instance, **kwargs):
+    "Drops the profile's cached auth token resolution"
+    token_cache.forget(token=instance.auth_token, user_id=instance.user_id)
+
+@receiver(models.signals.post_save, sender=User)
+@receiver(models.signals.post_delete, sender=User)
+def forget_user_auth_tokens(sender, instance, **kwargs):
+    "Drops cached auth token resolutions to a changed user"
+    token_cache.forget(user_id=instance.id)
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from profiles2.models import Profile
+from profiles2.tokens import resolve_auth_token
 import logging
 import re
 
@@ -61,15 +62,16 @@ class AuthTokenUserSerializer(serializers.Serializer):
     "Translates an auth token into a user"
     auth_token = serializers.CharField(max_length=100, write_only=True)
 
+    def token_user(self, token):
+        "Returns the user a token belongs to, resolved at most once per request (see profiles2.tokens)"
+        return resolve_auth_token(token, self.context.get('request'))
+
     def validate_auth_token(self, value):
-        try:
-            profile = Profile.objects.get(auth_token=value)
-        except Profile.DoesNotExist:
+        if self.token_user(value) is None:
             raise serializers.ValidationError("Invalid auth token")
         return value
 
     def create(self, validated_data):
-        profile = Profile.objects.get(auth_token=validated_data['auth_token'])
-        return profile.user
+        return self.token_user(validated_data['auth_token'])
 
 
@@ -0,0 +1,74 @@
+"""
+Resolves auth tokens to users.
+
+Resolved users are memoized on the request, so validating and then creating a like, upvote,
+flag or comment looks the token up once, and kept in a bounded, per-process LRU with a TTL
+(AUTH_TOKEN_CACHE). Receivers in profiles2.models drop entries when a profile or its user is
+saved or deleted. Unknown tokens are not cached.
+"""
+from django.conf import settings
+from collections import OrderedDict
+from threading import Lock
+import time
+
+def token_cache_setting(key, default=None):
+    return getattr(settings, 'AUTH_TOKEN_CACHE', {}).get(key, default)
+
+class TokenCache:
+    "A thread-safe LRU of token -> user, whose entries expire after a time to live"
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, token):
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires < time.monotonic():
+                del self.entries[token]
+                return None
+            self.entries.move_to_end(token)
+            return user
+
+    def set(self, token, user):
+        with self.lock:
+            self.entries[token] = (user, time.monotonic() + token_cache_setting('ttl', 300))
+            self.entries.move_to_end(token)
+            while len(self.entries) > token_cache_setting('size', 1024):
+                self.entries.popitem(last=False)
+
+    def forget(self, token=None, user_id=None):
+        "Drops the entry for a token, or every entry for a user"
+        with self.lock:
+            if token is not None:
+                self.entries.pop(token, None)
+            if user_id is not None:
+                for key in [k for k, (user, expires) in self.entries.items() if user.id == user_id]:
+                    del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+token_cache = TokenCache()
+
+def resolve_auth_token(token, request=None):
+    "Returns the user an auth token belongs to, or None"
+    from profiles2.models import Profile
+    memo = getattr(request, 'auth_token_users', None)
+    if memo is None and request is not None:
+        memo = request.auth_token_users = {}
+    if memo is not None and token in memo:
+        return memo[token]
+    user = token_cache.get(token)
+    if user is None:
+        profile = Profile.objects.select_related('user').filter(auth_token=token).first()
+        user = profile.user if profile else None
+        if user is not None:
+            token_cache.set(token, user)
+    if memo is not None:
+        memo[token] = user
+    return user
@@ -12,6 +12,8 @@ from rest_framework import mixins
 from rest_framework.permissions import AllowAny
 from django.http import HttpResponse
 from push_notifications.models import APNSDevice
+from django.core.exceptions import ImproperlyConfigured
+from stories2.apns import DeliveryError, send_to_devices
 
 class ProfileViewSet(mixins.CreateModelMixin, 
                    mixins.RetrieveModelMixin, 
@@ -35,24 +37,22 @@ class ProfileViewSet(mixins.CreateModelMixin,
     @detail_route(methods=['post', 'get'])
     def notify(self, request, pk):
         "Sends a test push notification to the user"
+        devices = APNSDevice.objects.filter(user=self.get_object().user, active=True)
+        if not devices:
+            return HttpResponse("User has not registered a device.", 
+                    status=400)
         try:
-            device = APNSDevice.objects.get(user=self.get_object().user)
-            device.send_message(None, extra={
+            rejected = send_to_devices(devices, {
                 "aps":{
                     "alert": "This is a test notification",
                     "sound": "default",
-                    "badge": 1,
-                    "deeplink": subject.ios_deeplink()
+                    "badge": 1
                 }
             })
-            return HttpResponse("Notification sent")
-
-        except APNSDevice.DoesNotExist:
-            return HttpResponse("User has not registered a device.", 
-                    status=400)
-            
-        
-
-
-
-
+        except ImproperlyConfigured as e:
+            return HttpResponse("Push notifications are not configured: {}".format(e), status=503)
+        except (DeliveryError, OSError) as e:
+            return HttpResponse("Could not send through APNS: {}".format(e), status=502)
+        if rejected == len(devices):
+            return HttpResponse("The user's device is no longer registered.", status=400)
+        return HttpResponse("Notification sent")
@@ -0,0 +1,83 @@
+"""
+Batched engagement for /v2/actions, so a client coming back online can replay its queue of
+likes, upvotes and flags in one request.
+
+Each kind of action is applied with a fixed number of queries however many there are: one to
+load its targets, one to find the user's existing engagements, one bulk INSERT, and one
+UPDATE of the counters, plus one read and one UPDATE of the weights in hot mode (see
+stories2.models.increment_counts). Repeats, including repeats within the batch, are
+reported as existing rather than failing, like the single routes.
+"""
+from django.db import transaction, IntegrityError
+from collections import namedtuple, OrderedDict
+from stories2.models import (FeedEntry, Story, Topic, Comment, StoryLike, TopicLike, CommentUpvote,
+        CommentFlag, increment_counts)
+
+ActionType = namedtuple('ActionType', 'model user_field target_field target_model kind counter_model counter_field')
+
+ACTION_TYPES = OrderedDict([
+    ('like_story', ActionType(StoryLike, 'liker', 'story', Story, 'story', FeedEntry, 'like_count')),
+    ('like_topic', ActionType(TopicLike, 'liker', 'topic', Topic, 'topic', FeedEntry, 'like_count')),
+    ('upvote', ActionType(CommentUpvote, 'author', 'comment', Comment, 'comment', Comment, 'upvote_count')),
+    ('flag', ActionType(CommentFlag, 'author', 'comment', Comment, 'comment', Comment, 'flag_count')),
+])
+
+def result(action, status, detail=None):
+    item = OrderedDict([('type', action['type']), ('id', action['id']), ('status', status)])
+    if detail:
+        item['detail'] = detail
+    return item
+
+def load_targets(action_type, ids):
+    "Returns {id: author id} for comments, or {id: None} for feed entries, of the targets that exist"
+    queryset = action_type.target_model._base_manager.filter(pk__in=ids)
+    if action_type.target_model is Comment:
+        return dict(queryset.values_list('id', 'author_id'))
+    return dict.fromkeys(queryset.values_list('id', flat=True))
+
+def apply_actions(user, actions, attempts=2):
+    """
+    Applies a list of {'type', 'id'} actions for a user in one transaction. Returns a result
+    for each action, in order, with a status of 'created', 'exists' or 'error'. If a
+    concurrent request inserts one of the same engagements first, the batch is retried.
+    """
+    try:
+        return apply_actions_once(user, actions)
+    except IntegrityError:
+        if attempts <= 1:
+            raise
+        return apply_actions(user, actions, attempts - 1)
+
+def apply_actions_once(user, actions):
+    results = [None] * len(actions)
+    by_type = OrderedDict()
+    for i, action in enumerate(actions):
+        by_type.setdefault(action['type'], []).append(i)
+    with transaction.atomic():
+        for type_name, positions in by_type.items():
+            action_type = ACTION_TYPES[type_name]
+            ids = {actions[i]['id'] for i in positions}
+            targets = load_targets(action_type, ids)
+            target_column = action_type.target_field + '_id'
+            existing = set(action_type.model.objects.filter(**{
+                action_type.user_field: user, target_column + '__in': ids
+            }).values_list(target_column, flat=True))
+            new_ids = []
+            for i in positions:
+                pk = actions[i]['id']
+                if pk not in targets:
+                    results[i] = result(actions[i], 'error', "Not found")
+                elif type_name == 'upvote' and targets[pk] == user.id:
+                    results[i] = result(actions[i], 'error', "Users may not upvote their own comments")
+                elif pk in existing:
+                    results[i] = result(actions[i], 'exists')
+                else:
+                    results[i] = result(actions[i], 'created')
+                    existing.add(pk)
+                    new_ids.append(pk)
+            action_type.model.objects.bulk_create([
+                action_type.model(**{action_type.user_field: user, target_column: pk}) for pk in new_ids
+            ])
+            increment_counts(action_type.counter_model, action_type.counter_field,
+                    [(action_type.kind, pk) for pk in new_ids])
+    return results
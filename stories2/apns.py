@@ -0,0 +1,148 @@
+"""
+Batched delivery over the APNS binary protocol.
+
+push_notifications opens a connection per call and gives up at the first rejected token, so
+a fanout to many devices pays a TLS handshake per user and stale tokens are never noticed.
+deliver() streams a whole batch of notifications over one connection. When APNS rejects a
+frame it sends an error response naming the frame and closes the connection; deliver()
+records the failure, reconnects and resumes after that frame. Devices whose tokens were
+rejected are deactivated, so later fanouts skip them.
+
+APNS_DELIVERY sets the address (by default APNS_HOST and APNS_PORT from
+PUSH_NOTIFICATIONS_SETTINGS) and whether to use TLS; `manage.py apns_standin` runs a local
+server that speaks the protocol, for development and `manage.py benchmark_push`.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from push_notifications.models import APNSDevice
+from push_notifications.settings import PUSH_NOTIFICATIONS_SETTINGS
+from binascii import unhexlify, Error as HexError
+from contextlib import closing
+import json
+import select
+import socket
+import ssl
+import struct
+import time
+
+INVALID_TOKEN_SIZE = 5
+INVALID_PAYLOAD_SIZE = 7
+INVALID_TOKEN = 8
+SHUTDOWN = 10
+REJECTED_TOKEN_STATUSES = (INVALID_TOKEN_SIZE, INVALID_TOKEN)
+MAX_PAYLOAD_SIZE = 2048
+
+ERROR_RESPONSE = struct.Struct('!BBI')
+
+class DeliveryError(Exception):
+    "The connection failed without APNS saying which notifications it had accepted"
+
+def delivery_setting(key, default=None):
+    return getattr(settings, 'APNS_DELIVERY', {}).get(key, default)
+
+def address():
+    return (delivery_setting('host') or PUSH_NOTIFICATIONS_SETTINGS['APNS_HOST'],
+            delivery_setting('port') or PUSH_NOTIFICATIONS_SETTINGS['APNS_PORT'])
+
+def connect(to=None):
+    sock = socket.create_connection(to or address(), timeout=delivery_setting('timeout', 10))
+    if not delivery_setting('tls', True):
+        return sock
+    certfile = PUSH_NOTIFICATIONS_SETTINGS.get('APNS_CERTIFICATE')
+    if not certfile:
+        raise ImproperlyConfigured('Set PUSH_NOTIFICATIONS_SETTINGS["APNS_CERTIFICATE"] to send through APNS.')
+    context = ssl.create_default_context(cafile=PUSH_NOTIFICATIONS_SETTINGS.get('APNS_CA_CERTIFICATES'))
+    context.load_cert_chain(certfile)
+    return context.wrap_socket(sock, server_hostname=address()[0] if to is None else to[0])
+
+def encode(payload):
+    return json.dumps(payload, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+def frame(identifier, token, payload, expiration=None, priority=10):
+    "Packs a notification as a command 2 frame"
+    expiration = expiration if expiration is not None else int(time.time()) + 30 * 24 * 60 * 60
+    items = b''.join([
+        struct.pack('!BH', 1, len(token)) + token,
+        struct.pack('!BH', 2, len(payload)) + payload,
+        struct.pack('!BHI', 3, 4, identifier),
+        struct.pack('!BHI', 4, 4, expiration),
+        struct.pack('!BHB', 5, 1, priority),
+    ])
+    return struct.pack('!BI', 2, len(items)) + items
+
+def read_error(sock, timeout):
+    "Returns (status, identifier) if APNS reported an error within timeout seconds, otherwise None"
+    readable, _, _ = select.select([sock], [], [], timeout)
+    if not readable:
+        return None
+    try:
+        data = sock.recv(ERROR_RESPONSE.size)
+    except OSError:
+        return None
+    if len(data) < ERROR_RESPONSE.size:
+        return None
+    command, status, identifier = ERROR_RESPONSE.unpack(data)
+    return status, identifier
+
+def stream(sock, frames, start):
+    "Writes frames from start on, returning the first error response, if any"
+    for identifier in range(start, len(frames)):
+        if frames[identifier] is None:
+            continue
+        try:
+            sock.sendall(frames[identifier])
+        except OSError as e:
+            error = read_error(sock, delivery_setting('error_timeout', 1))
+            if error is None:
+                raise DeliveryError(e)
+            return error
+        # An error response means APNS dropped everything after it, so stop early
+        error = read_error(sock, 0)
+        if error is not None:
+            return error
+    return read_error(sock, delivery_setting('error_timeout', 1))
+
+def deliver(messages, to=None):
+    """
+    Sends (token, payload) messages over one connection, reconnecting after each rejected
+    frame. Returns {index: status} for the messages which failed. Raises DeliveryError if
+    the connection fails without APNS saying where.
+    """
+    failures = {}
+    frames = []
+    for i, (token, payload) in enumerate(messages):
+        data = encode(payload)
+        try:
+            token = unhexlify(token)
+        except (HexError, TypeError):
+            failures[i] = INVALID_TOKEN
+            token = None
+        if len(data) > MAX_PAYLOAD_SIZE:
+            failures[i] = INVALID_PAYLOAD_SIZE
+        frames.append(None if i in failures else frame(i, token, data))
+    start = 0
+    while any(frames[start:]):
+        with closing(connect(to)) as sock:
+            error = stream(sock, frames, start)
+        if error is None:
+            break
+        status, identifier = error
+        if identifier < start or identifier >= len(frames):
+            raise DeliveryError("APNS reported status {} for unknown frame {}".format(status, identifier))
+        if status != SHUTDOWN: # On shutdown, identifier is the last frame delivered
+            failures[identifier] = status
+        start = identifier + 1
+    return failures
+
+def deactivate(tokens):
+    "Stops sending to devices whose tokens APNS rejected"
+    if tokens:
+        APNSDevice.objects.filter(registration_id__in=tokens, active=True).update(active=False)
+
+def send_to_devices(devices, payload):
+    "Sends one payload to APNSDevices, deactivating any whose tokens are rejected. Returns the number rejected."
+    tokens = [device.registration_id for device in devices]
+    failures = deliver([(token, payload) for token in tokens])
+    rejected = [tokens[i] for i, status in failures.items() if status in REJECTED_TOKEN_STATUSES]
+    deactivate(rejected)
+    return len(rejected)
@@ -0,0 +1,68 @@
+"""
+A local stand-in for the APNS binary protocol, for development and benchmarks.
+
+It accepts command 2 frames over plain TCP and counts what it delivers. Like APNS, it answers
+a bad frame with an error response naming it and closes the connection. Tokens must be 32
+bytes, and tokens starting with "dead" are treated as belonging to uninstalled apps. Point
+APNS_DELIVERY at it with {"host": "localhost", "port": 2195, "tls": False}.
+"""
+from stories2.apns import ERROR_RESPONSE, INVALID_TOKEN_SIZE, INVALID_TOKEN, INVALID_PAYLOAD_SIZE, MAX_PAYLOAD_SIZE
+from socketserver import ThreadingTCPServer, StreamRequestHandler
+from threading import Lock, Thread
+import struct
+
+DEAD_TOKEN_PREFIX = b'\xde\xad'
+
+def parse_items(data):
+    "Returns {item id: value} for the items of a frame"
+    items = {}
+    offset = 0
+    while offset < len(data):
+        item_id, length = struct.unpack_from('!BH', data, offset)
+        items[item_id] = data[offset + 3:offset + 3 + length]
+        offset += 3 + length
+    return items
+
+def status_for(token, payload):
+    if len(token) != 32:
+        return INVALID_TOKEN_SIZE
+    if token.startswith(DEAD_TOKEN_PREFIX):
+        return INVALID_TOKEN
+    if len(payload) > MAX_PAYLOAD_SIZE:
+        return INVALID_PAYLOAD_SIZE
+    return 0
+
+class APNSHandler(StreamRequestHandler):
+    def handle(self):
+        while True:
+            header = self.rfile.read(5)
+            if len(header) < 5:
+                return
+            command, length = struct.unpack('!BI', header)
+            items = parse_items(self.rfile.read(length))
+            identifier, = struct.unpack('!I', items.get(3, b'\0\0\0\0'))
+            status = 1 if command != 2 else status_for(items.get(1, b''), items.get(2, b''))
+            if status:
+                self.server.count('rejected')
+                self.wfile.write(ERROR_RESPONSE.pack(8, status, identifier))
+                return
+            self.server.count('delivered')
+
+class APNSStandIn(ThreadingTCPServer):
+    "Serves the APNS binary protocol on (host, port); port 0 picks a free one"
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('localhost', 0)):
+        super().__init__(address, APNSHandler)
+        self.lock = Lock()
+        self.counts = {'delivered': 0, 'rejected': 0}
+
+    def count(self, outcome):
+        with self.lock:
+            self.counts[outcome] += 1
+
+    def start(self):
+        "Serves from a background thread"
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self
@@ -0,0 +1,92 @@
+"""
+Versioned object cache for the v2 detail endpoints.
+
+Serialized payloads are keyed by model, pk, the object's version, the model's generation and
+the request URL (which covers query parameters such as ?fields= and the host used in absolute
+links). Signal receivers in stories2.models bump an object's version whenever it, or anything
+shown in its payload, changes; bulk updates which bypass signals (such as update_feed) bump the
+whole model's generation instead. Stale payloads are never overwritten, just no longer read,
+and expire after OBJECT_CACHE['timeout'] seconds.
+
+The cache alias is OBJECT_CACHE['alias']; Django's default local-memory cache works, and a
+shared backend can be configured in CACHES.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from threading import Lock
+from hashlib import md5
+import time
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = Lock()
+
+def cache_setting(key, default=None):
+    return getattr(settings, 'OBJECT_CACHE', {}).get(key, default)
+
+def object_cache():
+    return caches[cache_setting('alias', 'default')]
+
+def version_key(model_name, pk):
+    return 'objcache:version:{}:{}'.format(model_name, pk)
+
+def get_version(model_name, pk):
+    """
+    Returns the current version of an object. Versions start from the current time in
+    milliseconds, so a version evicted from the cache never comes back with an old number.
+    """
+    cache = object_cache()
+    key = version_key(model_name, pk)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+def increment(key):
+    try:
+        object_cache().incr(key)
+    except ValueError:
+        pass # No version yet, so nothing is cached
+
+def bump(model_name, pk):
+    """
+    Invalidates the cached payloads of one object. Inside a transaction the version is bumped
+    again on commit, so payloads built from uncommitted-elsewhere rows in between don't linger.
+    """
+    if pk is None:
+        return
+    key = version_key(model_name, pk)
+    increment(key)
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: increment(key))
+
+def bump_all(model_name):
+    "Invalidates the cached payloads of every object of a model"
+    bump(model_name, '*')
+
+def count(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+def stats():
+    "Returns this process's hit and miss counts"
+    with _stats_lock:
+        return dict(_stats)
+
+def cached_payload(model_name, pk, url, build):
+    """
+    Returns the payload cached for an object and request URL, calling build() to create it
+    on a miss. Also returns whether it was a hit.
+    """
+    cache = object_cache()
+    key = 'objcache:{}:{}:{}:{}:{}'.format(model_name, pk, get_version(model_name, pk),
+            get_version(model_name, '*'), md5(url.encode('utf-8')).hexdigest())
+    payload = cache.get(key)
+    if payload is not None:
+        count('hits')
+        return payload, True
+    count('misses')
+    payload = build()
+    cache.set(key, payload, cache_setting('timeout', 60 * 60))
+    return payload, False
@@ -0,0 +1,85 @@
+"""
+The change sequence behind /v2/changes, for clients syncing an offline cache.
+
+Receivers in stories2.models append a Change row whenever a story, topic or comment is
+created, updated or deactivated, and whenever its counts change. A client keeps the last
+token (change id) it has seen and asks for what happened after it. Repeated changes to the
+same object are collapsed to the latest of each action, and count changes carry the current
+counts, so a day of likes and comments comes back as a few small pages. Clients then
+multi-get created and updated objects with ?ids=.
+"""
+from django.conf import settings
+from django.db.models import Max
+from django.utils.timezone import now
+from collections import OrderedDict
+from datetime import timedelta
+from stories2.models import Change, FeedEntry, Comment
+
+def change_feed_setting(key, default=None):
+    return getattr(settings, 'CHANGE_FEED', {}).get(key, default)
+
+def settled():
+    "Changes younger than CHANGE_FEED['settle'] are held back, so late commits with lower ids aren't skipped"
+    return now() - timedelta(seconds=change_feed_setting('settle', 2))
+
+def latest_token():
+    return Change.objects.aggregate(Max('id'))['id__max'] or 0
+
+def current_token():
+    "The token a client should sync from after a full download"
+    return Change.objects.filter(created_at__lte=settled()).aggregate(Max('id'))['id__max'] or 0
+
+def expired(since):
+    "Whether changes after `since` have already been pruned, so the client must resync"
+    oldest = Change.objects.order_by('id').values_list('id', flat=True).first()
+    return oldest is not None and since < oldest - 1
+
+def prune(days):
+    """
+    Deletes changes older than `days` days, always keeping the latest so expired() can tell
+    which tokens are out of date. Returns the number deleted.
+    """
+    old = Change.objects.filter(created_at__lt=now() - timedelta(days=days)).exclude(id=latest_token())
+    deleted, by_model = old.delete()
+    return deleted
+
+def changes_since(since, limit):
+    """
+    Returns up to `limit` collapsed changes after the token `since`, as rows of (kind, object
+    id, action, seq) ordered by seq, the id of the latest change each stands for; and whether
+    there are more.
+    """
+    rows = list(Change.objects.filter(id__gt=since, created_at__lte=settled())
+            .values_list('kind', 'object_id', 'action')
+            .annotate(seq=Max('id'))
+            .order_by('seq')[:limit + 1])
+    return rows[:limit], len(rows) > limit
+
+def current_counts(rows):
+    "Loads the current counts of the objects in count changes, returning {(kind, id): counts}"
+    ids = {'entry': [], 'comment': []}
+    for kind, pk, action, seq in rows:
+        if action == 'counts':
+            ids['comment' if kind == 'comment' else 'entry'].append(pk)
+    counts = {}
+    if ids['entry']:
+        entries = FeedEntry.objects.non_polymorphic().filter(pk__in=ids['entry'])
+        for pk, ctype_kind, like_count, comment_count in entries.values_list(
+                'id', 'polymorphic_ctype__model', 'like_count', 'comment_count'):
+            counts[(ctype_kind, pk)] = OrderedDict([('like_count', like_count), ('comment_count', comment_count)])
+    if ids['comment']:
+        for pk, upvotes, flags in Comment.objects.filter(pk__in=ids['comment']).values_list(
+                'id', 'upvote_count', 'flag_count'):
+            counts[('comment', pk)] = OrderedDict([('upvotes', upvotes), ('flags', flags)])
+    return counts
+
+def represent_changes(rows):
+    "Represents collapsed changes as compact dicts"
+    counts = current_counts(rows)
+    changes = []
+    for kind, pk, action, seq in rows:
+        change = OrderedDict([('seq', seq), ('type', kind), ('id', pk), ('action', action)])
+        if action == 'counts':
+            change.update(counts.get((kind, pk), {}))
+        changes.append(change)
+    return changes
@@ -0,0 +1,101 @@
+"""
+HTTP conditional GET for the v2 viewsets.
+
+ETags and Last-Modified dates are computed from updated_at and the engagement counters, read
+with one small query (an indexed lookup for a detail, one aggregate for a list) before anything
+is serialized. The query skips the view's annotations (see validator_queryset). Clients
+sending a matching If-None-Match or If-Modified-Since get a 304 Not Modified without the
+payload being built. Changes to related rows shown in a representation (images, categories,
+topic stories, publication story counts) touch updated_at; see the receivers in
+stories2.models.
+"""
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from calendar import timegm
+from functools import wraps
+from hashlib import md5
+
+def make_etag(request, *validators):
+    "Hashes validators with the URL and negotiated media type, which also determine the body"
+    parts = [request.build_absolute_uri(), request.accepted_renderer.media_type]
+    parts += [str(v) for v in validators]
+    return md5('|'.join(parts).encode('utf-8')).hexdigest()
+
+def timestamp(value):
+    return timegm(value.utctimetuple()) if value else None
+
+def conditional_response(request, etag, last_modified, respond):
+    """
+    Returns 304 Not Modified if the client's copy is current, and otherwise respond(). Either
+    way the response carries the ETag and Last-Modified headers.
+    """
+    last_modified = timestamp(last_modified)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = respond()
+    if response.status_code in (200, 304):
+        response['ETag'] = quote_etag(etag)
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+    return response
+
+def conditional_get(validators):
+    """
+    Decorates a viewset method to answer conditional GETs, using the named method returning
+    (etag, last modified), or None to skip the check.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            if getattr(self, 'validated', False): # an outer method already checked
+                return method(self, request, *args, **kwargs)
+            self.validated = True
+            result = getattr(self, validators)()
+            if result is None:
+                return method(self, request, *args, **kwargs)
+            return conditional_response(request, *result, lambda: method(self, request, *args, **kwargs))
+        return wrapper
+    return decorator
+
+class ConditionalGetMixin:
+    """
+    Adds conditional GET to list and retrieve. The representation of a row is determined by
+    its updated_at and `etag_fields`. Viewsets overriding list or retrieve decorate their
+    methods with conditional_get. Viewsets add annotations in their own get_queryset, which
+    the validators skip, and list this mixin first.
+    """
+    etag_fields = ()
+
+    def validator_queryset(self):
+        """
+        The requested rows, filtered by the view's queryset, parent lookups and filters, but
+        without the annotations, related loading and ordering the viewset's get_queryset adds
+        """
+        queryset = super(ConditionalGetMixin, self).get_queryset()
+        return self.filter_queryset(queryset).select_related(None).prefetch_related(None).order_by()
+
+    def detail_validators(self):
+        "Returns (etag, last modified) for the requested object, or None if it isn't found"
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            row = self.validator_queryset().filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]}).values_list(
+                    'updated_at', *self.etag_fields).first()
+        except ValueError:
+            return None
+        if row is None:
+            return None
+        return make_etag(self.request, *row), row[0]
+
+    def list_validators(self):
+        "Returns (etag, last modified) for the requested list"
+        stats = self.validator_queryset().aggregate(last_modified=Max('updated_at'), count=Count('pk'))
+        return make_etag(self.request, stats['last_modified'], stats['count']), stats['last_modified']
+
+    @conditional_get('detail_validators')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @conditional_get('list_validators')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
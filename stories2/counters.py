@@ -0,0 +1,37 @@
+"""
+Bulk repair for the denormalized engagement counters on FeedEntry and Comment.
+
+The counters are maintained incrementally by signal receivers in stories2.models; these
+statements recount everything from the underlying tables in one UPDATE per counter, touching
+only the rows which have drifted.
+"""
+from django.db import connection, transaction
+from stories2 import cache
+
+COUNT_QUERIES = [
+    ('stories2_feedentry', 'like_count',
+        "(SELECT COUNT(*) FROM stories2_storylike WHERE stories2_storylike.story_id = stories2_feedentry.id) + "
+        "(SELECT COUNT(*) FROM stories2_topiclike WHERE stories2_topiclike.topic_id = stories2_feedentry.id)"),
+    ('stories2_feedentry', 'comment_count',
+        "(SELECT COUNT(*) FROM stories2_comment WHERE stories2_comment.story_id = stories2_feedentry.id "
+        "OR stories2_comment.topic_id = stories2_feedentry.id)"),
+    ('stories2_comment', 'upvote_count',
+        "(SELECT COUNT(*) FROM stories2_commentupvote WHERE stories2_commentupvote.comment_id = stories2_comment.id)"),
+    ('stories2_comment', 'flag_count',
+        "(SELECT COUNT(*) FROM stories2_commentflag WHERE stories2_commentflag.comment_id = stories2_comment.id)"),
+]
+
+def reconcile_sql(table, column, count):
+    return "UPDATE {table} SET {column} = {count}, updated_at = CURRENT_TIMESTAMP WHERE {column} != {count}".format(
+            table=table, column=column, count=count)
+
+def reconcile_counts():
+    "Recounts every counter, invalidating cached stories and topics. Returns a list of (table, column, rows repaired)."
+    results = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for table, column, count in COUNT_QUERIES:
+            cursor.execute(reconcile_sql(table, column, count))
+            results.append((table, column, cursor.rowcount))
+    cache.bump_all('story')
+    cache.bump_all('topic')
+    return results
@@ -0,0 +1,168 @@
+"""
+Live comment streams for open discussions.
+
+Receivers in stories2.models publish new comments and comment count changes to an in-process
+event bus once their transaction commits. GET /v2/stories/<id>/stream/ and
+/v2/topics/<id>/stream/ relay a thread's events as server-sent events, so a client with a
+discussion open loads the comments once and then only receives what changes, instead of
+polling the whole thread.
+
+Each event has an id, which clients send back as Last-Event-ID when they reconnect. The bus
+keeps the last EVENT_STREAM['backlog'] events of each thread to resume from, and forgets a
+thread EVENT_STREAM['linger'] seconds after its last stream closes; a client too far behind
+(or reconnecting to another process, or later than that) gets a `reset` event and should
+reload the list.
+The bus only sees writes made by its own process, and each open stream holds a worker thread
+for up to EVENT_STREAM['max_duration'] seconds, so serve streams from a threaded server.
+"""
+from django.conf import settings
+from django.db import transaction
+from collections import defaultdict, deque
+from rest_framework.renderers import BaseRenderer
+from threading import Lock, Condition
+import json
+import time
+
+def event_stream_setting(key, default=None):
+    return getattr(settings, 'EVENT_STREAM', {}).get(key, default)
+
+class EventBus:
+    """
+    Keeps recent events by thread and wakes the streams waiting on them. A thread is kept while
+    it has streams, and for a while after, so clients reconnecting at the end of a stream can
+    resume; then its events are dropped.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.conditions = {}
+        self.events = defaultdict(lambda: deque(maxlen=event_stream_setting('backlog', 100)))
+        self.listeners = defaultdict(int)
+        self.idle = {} # When threads without streams lost their last one
+        # Ids start from the time, so ids from before a restart read as too old rather than current
+        self.last_id = int(time.time() * 1000)
+        # The newest id of each thread's events that are no longer kept
+        self.evicted = {}
+
+    def condition(self, key):
+        if key not in self.conditions:
+            self.conditions[key] = Condition(self.lock)
+        return self.conditions[key]
+
+    def listening(self, key=None):
+        "Whether any thread, or the thread key, has streams open or about to reconnect"
+        with self.lock:
+            return key in self.listeners or key in self.idle if key else bool(self.listeners or self.idle)
+
+    def publish(self, key, event, data):
+        with self.lock:
+            if key not in self.listeners and key not in self.idle: # The thread was forgotten before this committed
+                return
+            self.last_id += 1
+            events = self.events[key]
+            if len(events) == events.maxlen:
+                self.evicted[key] = events[0][0]
+            events.append((self.last_id, event, data))
+            self.condition(key).notify_all()
+
+    def current(self):
+        with self.lock:
+            return self.last_id
+
+    def wait(self, key, after, timeout):
+        """
+        Waits up to timeout seconds for events on key after the id `after`. Returns the
+        events, or None if some of them are no longer kept.
+        """
+        with self.lock:
+            if after > self.last_id or after < self.evicted.get(key, self.last_id):
+                return None
+            newer = lambda: [e for e in self.events[key] if e[0] > after]
+            self.condition(key).wait_for(newer, timeout)
+            return newer()
+
+    def subscribe(self, key):
+        with self.lock:
+            self.forget_idle()
+            self.idle.pop(key, None)
+            # Nothing earlier is kept for a thread nobody was watching
+            self.evicted.setdefault(key, self.last_id)
+            self.listeners[key] += 1
+
+    def unsubscribe(self, key):
+        with self.lock:
+            self.listeners[key] -= 1
+            if not self.listeners[key]:
+                del self.listeners[key]
+                self.idle[key] = time.monotonic()
+            self.forget_idle()
+
+    def forget_idle(self):
+        "Drops threads whose last stream closed more than EVENT_STREAM['linger'] seconds ago. Call with the lock held."
+        cutoff = time.monotonic() - event_stream_setting('linger', 30)
+        for key in [key for key, since in self.idle.items() if since < cutoff]:
+            for state in (self.idle, self.conditions, self.events, self.evicted):
+                state.pop(key, None)
+
+bus = EventBus()
+
+def thread_key(story_id=None, topic_id=None):
+    return ('story', story_id) if story_id else ('topic', topic_id)
+
+def comment_created(comment):
+    "Publishes a new comment, represented as in comment lists, once it commits"
+    key = thread_key(comment.story_id, comment.topic_id)
+    if not bus.listening(key):
+        return
+    def publish():
+        from stories2.models import Comment
+        from stories2.fastpath import comment_values, represent_comments
+        for data in represent_comments(comment_values(Comment.objects.filter(pk=comment.pk))):
+            bus.publish(key, 'comment', data)
+    transaction.on_commit(publish)
+
+def counts_changed(comment_ids):
+    "Publishes the current upvote and flag counts of comments once they commit"
+    if not bus.listening():
+        return
+    comment_ids = list(comment_ids)
+    def publish():
+        from stories2.models import Comment
+        rows = Comment.objects.filter(pk__in=comment_ids).values_list(
+                'id', 'story_id', 'topic_id', 'upvote_count', 'flag_count')
+        for pk, story_id, topic_id, upvotes, flags in rows:
+            key = thread_key(story_id, topic_id)
+            if bus.listening(key):
+                bus.publish(key, 'counts', {'id': pk, 'upvotes': upvotes, 'flags': flags})
+    transaction.on_commit(publish)
+
+class EventStreamRenderer(BaseRenderer):
+    "Lets stream routes negotiate text/event-stream; the events themselves are streamed, not rendered"
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data)
+
+def format_event(event_id, event, data):
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(event_id, event, json.dumps(data))
+
+def stream(key, last_event_id=None):
+    "Yields server-sent events for a thread, starting after last_event_id if given"
+    bus.subscribe(key)
+    after = last_event_id if last_event_id is not None else bus.current()
+    deadline = time.monotonic() + event_stream_setting('max_duration', 300)
+    try:
+        yield 'retry: {}\n\n'.format(event_stream_setting('retry', 3000))
+        while time.monotonic() < deadline:
+            events = bus.wait(key, after, event_stream_setting('heartbeat', 15))
+            if events is None:
+                after = bus.current()
+                yield format_event(after, 'reset', {})
+            elif not events:
+                yield ': heartbeat\n\n' # Lets proxies and clients tell an idle stream from a dead one
+            for event_id, event, data in events or []:
+                after = event_id
+                yield format_event(event_id, event, data)
+    finally:
+        bus.unsubscribe(key)
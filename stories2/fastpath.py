@@ -0,0 +1,96 @@
+"""
+Hand-written list representations for the hot read-only endpoints.
+
+These build the same dicts as StorySerializer and CommentSerializer, in the same key order
+and so rendering to byte-identical JSON, straight from .values() rows. That skips DRF's
+per-object field introspection and SerializerMethodField dispatch. (The feed list is already
+built from plain pairs; see FeedViewSet.) Anything they don't cover, such as ?view=summary,
+goes through the serializers as before.
+"""
+from collections import OrderedDict, defaultdict
+from versatileimagefield.utils import build_versatileimagefield_url_set, get_rendition_key_set
+from stories2.models import Story, StoryImage
+
+STORY_FIELDS = ('id', 'title', 'weight', 'publisher', 'pub_id', 'pub_date', 'authors', 'comment_count',
+        'content', 'text', 'images', 'flat_image_urls', 'categories', 'like_count')
+COMMENT_FIELDS = ('id', 'author', 'author_username', 'story', 'topic', 'text', 'pub_date', 'upvotes', 'flags',
+        'promoted')
+
+# Representation field -> column, where they differ
+STORY_COLUMNS = {'publisher': 'publisher_id'}
+COMMENT_COLUMNS = {'author': 'author_id', 'author_username': 'author__profile__username', 'story': 'story_id',
+        'topic': 'topic_id', 'upvotes': 'upvote_count', 'flags': 'flag_count'}
+
+def format_datetime(value):
+    "Matches rest_framework.fields.DateTimeField with the default ISO 8601 format"
+    if not value:
+        return None
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+def columns(fields, renamed):
+    return [renamed.get(f, f) for f in fields]
+
+def story_values(queryset, fields=STORY_FIELDS):
+    "Turns a story queryset into a .values() queryset with only the columns needed for `fields`"
+    needed = [f for f in fields if f not in ('images', 'flat_image_urls', 'categories')]
+    needed += [f for f in ('id', 'pub_date') if f not in needed] # for pagination
+    return queryset.non_polymorphic().prefetch_related(None).values(*columns(needed, STORY_COLUMNS))
+
+def story_images(story_ids):
+    "Loads the images of many stories in one query, returning {story id: [image file]}"
+    images = defaultdict(list)
+    rows = StoryImage.objects.filter(story_id__in=story_ids).values_list('story_id', 'image')
+    for story_id, name in rows:
+        images[story_id].append(StoryImage(image=name).image)
+    return images
+
+def story_categories(story_ids):
+    "Loads the category ids of many stories in one query, returning {story id: [category id]}"
+    categories = defaultdict(list)
+    rows = Story.categories.through.objects.filter(story_id__in=story_ids).values_list('story_id', 'category_id')
+    for story_id, category_id in rows:
+        categories[story_id].append(category_id)
+    return categories
+
+def represent_stories(rows, request=None, fields=STORY_FIELDS):
+    "Represents a page of story_values() rows exactly as StorySerializer would"
+    ids = [row['id'] for row in rows]
+    images = story_images(ids) if 'images' in fields or 'flat_image_urls' in fields else {}
+    categories = story_categories(ids) if 'categories' in fields else {}
+    sizes = get_rendition_key_set('story_image')
+    stories = []
+    for row in rows:
+        story = OrderedDict()
+        for field in fields:
+            if field == 'images':
+                story[field] = [OrderedDict([('image', build_versatileimagefield_url_set(image, sizes, request))])
+                        for image in images.get(row['id'], [])]
+            elif field == 'flat_image_urls':
+                story[field] = [image.url for image in images.get(row['id'], [])]
+            elif field == 'categories':
+                story[field] = categories.get(row['id'], [])
+            elif field == 'pub_date':
+                story[field] = format_datetime(row['pub_date'])
+            else:
+                story[field] = row[STORY_COLUMNS.get(field, field)]
+        stories.append(story)
+    return stories
+
+def comment_values(queryset, fields=COMMENT_FIELDS):
+    "Turns a comment queryset into a .values() queryset with the columns needed for `fields`"
+    needed = list(fields) + [f for f in ('id', 'pub_date') if f not in fields] # for pagination
+    return queryset.values(*columns(needed, COMMENT_COLUMNS))
+
+def represent_comments(rows, fields=COMMENT_FIELDS):
+    "Represents a page of comment_values() rows exactly as CommentSerializer would"
+    comments = []
+    for row in rows:
+        comment = OrderedDict()
+        for field in fields:
+            value = row[COMMENT_COLUMNS.get(field, field)]
+            comment[field] = format_datetime(value) if field == 'pub_date' else value
+        comments.append(comment)
+    return comments
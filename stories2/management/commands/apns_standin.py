@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from stories2.apns_standin import APNSStandIn
+
+class Command(BaseCommand):
+    help = "Run a local stand-in for the APNS binary protocol, for development"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--port', type=int, default=2195)
+
+    def handle(self, *args, **options):
+        server = APNSStandIn((options['host'], options['port']))
+        self.stdout.write("Serving APNS on {}:{}; tokens starting with 'dead' are rejected".format(
+                *server.server_address))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write("{delivered} delivered, {rejected} rejected".format(**server.counts))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from stories2.apns import deliver, REJECTED_TOKEN_STATUSES
+from stories2.apns_standin import APNSStandIn
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer as timer
+import random
+
+def token(rng, dead=False):
+    return ('dead' if dead else 'beef') + '%060x' % rng.getrandbits(240)
+
+class Command(BaseCommand):
+    help = "Measure notification fanout throughput against a local APNS stand-in"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=10000)
+        parser.add_argument('--dead', type=float, default=0.01, help="Fraction of devices with rejected tokens")
+        parser.add_argument('--concurrency', default="1,4,8", help="Comma-separated connection counts")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        tokens = [token(rng, rng.random() < options['dead']) for i in range(options['devices'])]
+        payload = {"aps": {"alert": "3 new comments", "sound": "default", "badge": 3,
+                "deeplink": "paly://story/1"}}
+        server = APNSStandIn().start()
+        self.stdout.write("{:>12} {:>10} {:>12} {:>10}".format("connections", "seconds", "pushes/s", "rejected"))
+        with override_settings(APNS_DELIVERY={"tls": False, "error_timeout": 0.05}):
+            for concurrency in [int(n) for n in options['concurrency'].split(',')]:
+                chunks = [tokens[i::concurrency] for i in range(concurrency)]
+                start = timer()
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    failures = list(pool.map(lambda chunk: deliver([(t, payload) for t in chunk],
+                            to=server.server_address), chunks))
+                elapsed = timer() - start
+                rejected = sum(1 for f in failures for status in f.values() if status in REJECTED_TOKEN_STATUSES)
+                self.stdout.write("{:>12} {:>10.3f} {:>12.0f} {:>10}".format(
+                        concurrency, elapsed, len(tokens) / elapsed, rejected))
+        server.shutdown()
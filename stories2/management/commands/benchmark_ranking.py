@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from stories2.ranking import gravity_weights
+from datetime import datetime, timezone, timedelta
+from timeit import default_timer as timer
+import numpy as np
+
+def per_object_weights(pub_dates, like_counts, comment_counts, now):
+    "The original one-object-at-a-time weight computation from FeedEntry.update_weight"
+    weights = []
+    for pub_date, likes, comments in zip(pub_dates, like_counts, comment_counts):
+        score = 1 + likes + comments * settings.FEED_WEIGHT['comment_weight']
+        age_in_hours = (now - pub_date).total_seconds() / (60 * 60)
+        weights.append(score / pow(age_in_hours + 2, settings.FEED_WEIGHT['gravity']))
+    return weights
+
+class Command(BaseCommand):
+    help = "Compare batch (NumPy) feed scoring with the per-object path on synthetic feeds"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default="10000,100000,1000000",
+                help="Comma-separated feed sizes to benchmark")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        sizes = [int(n) for n in options['sizes'].split(',')]
+        rng = np.random.RandomState(options['seed'])
+        now = datetime.now(timezone.utc)
+        self.stdout.write("{:>10} {:>14} {:>14} {:>15} {:>9}".format(
+                "entries", "per-object (s)", "batch (s)", "batch+dates (s)", "speedup"))
+        for size in sizes:
+            ages = rng.uniform(0, 24 * 365, size)
+            pub_dates = [now - timedelta(hours=h) for h in ages]
+            likes = rng.poisson(3, size)
+            comments = rng.poisson(1, size)
+
+            start = timer()
+            expected = per_object_weights(pub_dates, likes.tolist(), comments.tolist(), now)
+            per_object = timer() - start
+
+            timestamps = now.timestamp() - ages * 60 * 60
+            start = timer()
+            weights = gravity_weights(timestamps, likes, comments, now)
+            batch = timer() - start
+
+            start = timer()
+            gravity_weights(pub_dates, likes, comments, now)
+            batch_with_dates = timer() - start
+
+            if not np.allclose(weights, expected):
+                raise CommandError("Batch weights differ from per-object weights at {} entries".format(size))
+            self.stdout.write("{:>10} {:>14.4f} {:>14.4f} {:>15.4f} {:>8.1f}x".format(
+                    size, per_object, batch, batch_with_dates, per_object / batch))
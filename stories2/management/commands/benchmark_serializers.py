@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.contrib.auth.models import User
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from stories2.models import Publication, Story, StoryImage, Category, Comment
+from stories2.serializers import StorySerializer, CommentSerializer
+from stories2.fastpath import story_values, represent_stories, comment_values, represent_comments
+from datetime import datetime, timedelta, timezone
+from timeit import default_timer as timer
+
+class Command(BaseCommand):
+    help = "Compare rows per second of the fast-path list representations and the DRF serializers. " \
+            "Runs against a temporary test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000, help="Number of stories and of comments")
+        parser.add_argument('--repeat', type=int, default=3, help="Take the best of this many runs")
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0)
+        try:
+            self.populate(options['rows'])
+            request = Request(APIRequestFactory().get('/v2/stories'))
+            self.compare("stories",
+                lambda: StorySerializer(Story.objects.prefetch_related('images', 'categories'),
+                        many=True, context={'request': request}).data,
+                lambda: represent_stories(list(story_values(Story.objects.all())), request),
+                options)
+            self.compare("comments",
+                lambda: CommentSerializer(Comment.objects.all(), many=True, context={'request': request}).data,
+                lambda: represent_comments(list(comment_values(Comment.objects.all()))),
+                options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def populate(self, rows):
+        now = datetime.now(timezone.utc)
+        pub = Publication.objects.create(name='Campanile', url='http://example.com',
+                feed_url='http://example.com/feed', logo='logo.png')
+        user = User.objects.create(username='benchmark')
+        categories = [Category.objects.create(name='Category {}'.format(i)) for i in range(5)]
+        for i in range(rows):
+            story = Story.objects.create(title='Story {}'.format(i), publisher=pub, pub_id=i, authors='Author',
+                    content='<p>{}</p>'.format('Content ' * 200), text='Text ' * 200, pub_date=now - timedelta(hours=i))
+            story.categories.add(*categories[:i % 4])
+            StoryImage.objects.bulk_create([StoryImage(story=story, image='images/paly.jpg', sequence=0)])
+        story_ids = list(Story.objects.values_list('id', flat=True))
+        Comment.objects.bulk_create([
+            Comment(author=user, story_id=story_ids[i % len(story_ids)], text='Comment {}'.format(i), pub_date=now)
+            for i in range(rows)
+        ])
+
+    def compare(self, name, drf, fast, options):
+        renderer = JSONRenderer()
+        results = {}
+        for label, represent in (('drf', drf), ('fast', fast)):
+            best = None
+            for i in range(options['repeat']):
+                start = timer()
+                content = renderer.render(represent())
+                elapsed = timer() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[label] = (best, content)
+        if results['drf'][1] != results['fast'][1]:
+            raise CommandError("Fast-path {} differ from the serializer output".format(name))
+        rows = options['rows']
+        drf_rate, fast_rate = rows / results['drf'][0], rows / results['fast'][0]
+        self.stdout.write("{:10} DRF: {:>10.0f} rows/s   fast path: {:>10.0f} rows/s   ({:.1f}x)".format(
+                name, drf_rate, fast_rate, fast_rate / drf_rate))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from stories2.changes import change_feed_setting, prune
+
+class Command(BaseCommand):
+    help = "Delete old entries from the change sequence. Clients which last synced before them must resync."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=change_feed_setting('keep', 7),
+                help="Keep changes from this many days (default CHANGE_FEED['keep'])")
+
+    def handle(self, *args, **options):
+        deleted = prune(options['days'])
+        self.stdout.write("Deleted {} changes".format(deleted))
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand, CommandError
+from stories2.counters import reconcile_counts
+
+class Command(BaseCommand):
+    help = "Repair drift in the like, comment, upvote and flag counters"
+
+    def handle(self, *args, **options):
+        for table, column, repaired in reconcile_counts():
+            self.stdout.write(self.style.SUCCESS("{}.{}: repaired {} rows".format(table, column, repaired)))
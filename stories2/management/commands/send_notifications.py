@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from stories2.outbox import drain
+import time
+
+class Command(BaseCommand):
+    help = "Send queued push notifications from the outbox, retrying failures with backoff"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Notifications claimed at a time")
+        parser.add_argument('--concurrency', type=int, default=8, help="APNS connections used in parallel")
+        parser.add_argument('--interval', type=float, default=5, help="Seconds to wait when the outbox is empty")
+        parser.add_argument('--once', action='store_true', help="Drain the outbox once and exit")
+
+    def handle(self, *args, **options):
+        while True:
+            outcomes = drain(options['batch_size'], options['concurrency'])
+            if outcomes:
+                self.stdout.write(", ".join("{} {}".format(n, outcome) for outcome, n in sorted(outcomes.items())))
+            elif options['once']:
+                return
+            else:
+                time.sleep(options['interval'])
@@ -2,6 +2,7 @@ from django.core.management.base import BaseCommand, CommandError
 from django.core import files
 from stories2.models import Publication, Story, Category, StoryImage
 from stories2.feeds import parsers
+from stories2 import snapshot
 
 class CommandLogger:
     "Roughly emulates a Logger API, emitting in the style of Django management commands"
@@ -52,16 +53,24 @@ class Command(BaseCommand):
             for entry in feed.entries():
                 try:
                     story = pub.stories.get(pub_id=entry.pub_id())
+                    changed = False
                     if options['force'] or entry.pub_date() > story.pub_date:
+                        fields = {
+                            'title': entry.title(),
+                            'pub_date': entry.pub_date(),
+                            'authors': entry.authors(),
+                            'content': entry.content(),
+                            'text': entry.text()
+                        }
+                        changed = any(getattr(story, name) != value for name, value in fields.items())
+                        for name, value in fields.items():
+                            setattr(story, name, value)
+                    if changed:
                         self.stdout.write(self.style.SUCCESS('  - Updating {}'.format(entry.title())))
-                        story.title = entry.title()
-                        story.pub_date = entry.pub_date()
-                        story.authors = entry.authors()
-                        story.content = entry.content()
-                        story.text = entry.text()
                     else:
                         self.stdout.write(self.style.SUCCESS('  - No change to {}'.format(entry.title())))
                 except Story.DoesNotExist:
+                    changed = True
                     self.stdout.write(self.style.SUCCESS('  - Creating {}'.format(entry.title())))
                     story = Story(
                         title = entry.title(),
@@ -72,7 +81,9 @@ class Command(BaseCommand):
                         content = entry.content(),
                         text = entry.text()
                     )
-                story.save()
+                # Saving marks the story updated for clients (changes, caches, ETags), so only save real changes
+                if changed:
+                    story.save()
                 for tag in entry.tags():
                     story.categories.add(Category.objects.get_or_create(name=tag)[0])
                 for url in entry.image_urls():
@@ -86,3 +97,4 @@ class Command(BaseCommand):
                     log.info("    - Image: {}".format(url))
             pub.last_update = feed.last_update()
             pub.save()
+        snapshot.rebuild()
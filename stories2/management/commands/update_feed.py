@@ -1,10 +1,19 @@
 from django.core.management.base import BaseCommand, CommandError
-from stories2.models import FeedEntry
+from stories2.ranking import recompute_weights, READ_CHUNK_SIZE
 
 class Command(BaseCommand):
     help = "Update the weight of all feed entries, based on likes, comments and age."
 
+    def add_arguments(self, parser):
+        parser.add_argument('--tolerance', type=float, default=None,
+                help="Skip entries whose weight would change by less than this fraction. "
+                "Defaults to FEED_WEIGHT['tolerance'].")
+        parser.add_argument('--all', action="store_true", dest="all", default=False,
+                help="Rewrite every weight, ignoring the tolerance")
+        parser.add_argument('--chunk-size', type=int, default=READ_CHUNK_SIZE, dest="chunk_size",
+                help="Number of entries to read per query")
+
     def handle(self, *args, **options):
-        for fe in FeedEntry.objects.all():
-            fe.update_weight()
-            fe.save()
+        tolerance = 0 if options['all'] else options['tolerance']
+        scanned, updated = recompute_weights(tolerance=tolerance, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS("Updated {} of {} feed entries".format(updated, scanned)))
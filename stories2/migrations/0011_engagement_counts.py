@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2018-04-12 10:14
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+BACKFILL = [
+    "UPDATE stories2_feedentry SET like_count = "
+    "(SELECT COUNT(*) FROM stories2_storylike WHERE stories2_storylike.story_id = stories2_feedentry.id) + "
+    "(SELECT COUNT(*) FROM stories2_topiclike WHERE stories2_topiclike.topic_id = stories2_feedentry.id)",
+    "UPDATE stories2_feedentry SET comment_count = "
+    "(SELECT COUNT(*) FROM stories2_comment WHERE stories2_comment.story_id = stories2_feedentry.id "
+    "OR stories2_comment.topic_id = stories2_feedentry.id)",
+    "UPDATE stories2_comment SET upvote_count = "
+    "(SELECT COUNT(*) FROM stories2_commentupvote WHERE stories2_commentupvote.comment_id = stories2_comment.id)",
+    "UPDATE stories2_comment SET flag_count = "
+    "(SELECT COUNT(*) FROM stories2_commentflag WHERE stories2_commentflag.comment_id = stories2_comment.id)",
+]
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories2', '0010_auto_20180405_1339'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='flag_count',
+            field=models.IntegerField(default=0, verbose_name='Flag Count'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='upvote_count',
+            field=models.IntegerField(default=0, verbose_name='Upvote Count'),
+        ),
+        migrations.AddField(
+            model_name='feedentry',
+            name='comment_count',
+            field=models.IntegerField(default=0, verbose_name='Comment Count'),
+        ),
+        migrations.AddField(
+            model_name='feedentry',
+            name='like_count',
+            field=models.IntegerField(default=0, verbose_name='Like Count'),
+        ),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+    ]
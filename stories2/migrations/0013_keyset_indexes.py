@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2018-04-16 11:27
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories2', '0012_feedentry_weight_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='feedentry',
+            name='weight',
+            field=models.FloatField(default=0, verbose_name='Weight'),
+        ),
+        migrations.AlterIndexTogether(
+            name='comment',
+            index_together=set([('story', 'pub_date', 'id'), ('pub_date', 'id'), ('topic', 'pub_date', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='feedentry',
+            index_together=set([('weight', 'id'), ('pub_date', 'id')]),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2018-04-19 14:37
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+
+# Keep the first like of each (entry, user) pair, then recount likes
+DEDUPE = [
+    "DELETE FROM stories2_storylike WHERE id NOT IN "
+    "(SELECT * FROM (SELECT MIN(id) FROM stories2_storylike GROUP BY story_id, liker_id) AS keep)",
+    "DELETE FROM stories2_topiclike WHERE id NOT IN "
+    "(SELECT * FROM (SELECT MIN(id) FROM stories2_topiclike GROUP BY topic_id, liker_id) AS keep)",
+    "UPDATE stories2_feedentry SET like_count = "
+    "(SELECT COUNT(*) FROM stories2_storylike WHERE stories2_storylike.story_id = stories2_feedentry.id) + "
+    "(SELECT COUNT(*) FROM stories2_topiclike WHERE stories2_topiclike.topic_id = stories2_feedentry.id)",
+]
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('stories2', '0015_change_sequence'),
+    ]
+
+    operations = [
+        migrations.RunSQL(DEDUPE, migrations.RunSQL.noop),
+        migrations.AlterUniqueTogether(
+            name='storylike',
+            unique_together=set([('story', 'liker')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='topiclike',
+            unique_together=set([('topic', 'liker')]),
+        ),
+    ]
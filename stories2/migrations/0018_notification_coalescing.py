@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2018-04-29 10:12
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('stories2', '0017_notification_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='count',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AlterIndexTogether(
+            name='notification',
+            index_together=set([('deeplink', 'status', 'user'), ('status', 'next_attempt')]),
+        ),
+    ]
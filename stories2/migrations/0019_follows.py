@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2018-05-01 14:40
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('stories2', '0018_notification_coalescing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoryFollow',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('follower', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='followed_stories', to=settings.AUTH_USER_MODEL)),
+                ('story', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='follows', to='stories2.Story')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TopicFollow',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('follower', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='followed_topics', to=settings.AUTH_USER_MODEL)),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='follows', to='stories2.Topic')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='comment',
+            index_together=set([('topic', 'pub_date', 'id'), ('story', 'author'), ('story', 'pub_date', 'id'), ('topic', 'author'), ('pub_date', 'id')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='topicfollow',
+            unique_together=set([('topic', 'follower')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='storyfollow',
+            unique_together=set([('story', 'follower')]),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2018-05-03 16:05
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('stories2', '0019_follows'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='comment',
+            index_together=set([('topic', 'pub_date', 'id'), ('pub_date', 'id'), ('story', 'author'), ('topic', 'author'), ('topic', 'upvote_count', 'pub_date', 'id'), ('story', 'promoted', 'upvote_count', 'pub_date', 'id'), ('topic', 'promoted', 'upvote_count', 'pub_date', 'id'), ('story', 'upvote_count', 'pub_date', 'id'), ('story', 'pub_date', 'id')]),
+        ),
+    ]
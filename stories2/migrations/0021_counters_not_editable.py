@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2018-05-04 09:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories2', '0020_comment_orderings'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='comment',
+            name='flag_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Flag Count'),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='upvote_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Upvote Count'),
+        ),
+        migrations.AlterField(
+            model_name='feedentry',
+            name='comment_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Comment Count'),
+        ),
+        migrations.AlterField(
+            model_name='feedentry',
+            name='like_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Like Count'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2018-05-04 11:45
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('stories2', '0021_counters_not_editable'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='comment',
+            index_together=set([('story', 'author'), ('topic', 'author'), ('pub_date', 'id'), ('topic', 'pub_date', 'id'), ('story', 'pub_date', 'id'), ('story', 'upvote_count', 'pub_date', 'id'), ('topic', 'updated_at'), ('story', 'promoted', 'upvote_count', 'pub_date', 'id'), ('story', 'updated_at'), ('topic', 'promoted', 'upvote_count', 'pub_date', 'id'), ('topic', 'upvote_count', 'pub_date', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='feedentry',
+            index_together=set([('active', 'updated_at'), ('pub_date', 'id'), ('weight', 'id')]),
+        ),
+    ]
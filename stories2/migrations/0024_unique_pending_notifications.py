@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2018-05-05 10:20
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def mark_pending(apps, schema_editor):
+    "Clears pending on sent and failed notifications, and merges duplicate pending ones"
+    Notification = apps.get_model('stories2', 'Notification')
+    Notification.objects.exclude(status='pending').update(pending=None)
+    duplicates = (Notification.objects.filter(pending=True).values('user', 'deeplink')
+            .annotate(n=Count('id'), total=Sum('count')).filter(n__gt=1))
+    for duplicate in duplicates:
+        rows = Notification.objects.filter(pending=True, user=duplicate['user'], deeplink=duplicate['deeplink'])
+        keep = rows.order_by('id').first()
+        rows.exclude(id=keep.id).delete()
+        Notification.objects.filter(id=keep.id).update(count=duplicate['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('stories2', '0023_notification_delivered'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='pending',
+            field=models.NullBooleanField(default=True, editable=False),
+        ),
+        migrations.RunPython(mark_pending, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='notification',
+            unique_together=set([('deeplink', 'user', 'pending')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='notification',
+            index_together=set([('status', 'next_attempt')]),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import F
 from django.dispatch import receiver
 from django.utils.timezone import now
 from datetime import datetime
@@ -11,9 +12,8 @@ import os
 from django.core import files
 import requests
 import tempfile
-from django.conf import settings
-from datetime import datetime, timezone
-from push_notifications.models import APNSDevice
+from stories2.ranking import feed_weight, ranking_mode, refresh_weight, refresh_weights
+from stories2 import cache, events
 
 def s3_image_upload(instance, filename):
     "Generates a path name for an image to upload"
@@ -23,6 +23,17 @@ def s3_image_upload(instance, filename):
         filename_ext.lower()
     )
 
+def without_counters(instance, counters, kwargs):
+    """
+    Leaves counter columns out of a full save() of an existing row, so counts loaded before
+    someone liked or upvoted can't overwrite theirs. Counters only change through
+    adjust_count and increment_counts.
+    """
+    if not instance._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+        kwargs['update_fields'] = [f.name for f in instance._meta.concrete_fields
+                if not f.primary_key and f.name not in counters]
+    return kwargs
+
 class Publication(models.Model):
     "Represents a Paly publication such as Campanile"
 
@@ -35,6 +46,7 @@ class Publication(models.Model):
     logo = models.ImageField(upload_to=s3_image_upload)
     last_update = models.DateTimeField(default=datetime(1900, 1, 1))
     active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -42,6 +54,7 @@ class Publication(models.Model):
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     story_count = models.IntegerField("Story Count", default=0)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -55,20 +68,36 @@ class FeedEntry(PolymorphicModel):
     weight = models.FloatField('Weight', default=0)
     pub_date = models.DateTimeField('Date published')
     active = models.BooleanField('Active', default=True)
+    like_count = models.IntegerField('Like Count', default=0, editable=False)
+    comment_count = models.IntegerField('Comment Count', default=0, editable=False)
+    updated_at = models.DateTimeField('Updated', auto_now=True)
+
+    counters = ('like_count', 'comment_count')
 
     def clean(self):
         "Updates weight on creation. Can't hardcode because weight is influenced by settings"
         self.update_weight()
 
-    # Using Hacker News gravity algorithm: 
-    # https://medium.com/hacking-and-gonzo/how-hacker-news-ranking-algorithm-works-1d9b0cf2c08d
     def update_weight(self):
-        score = 1 + self.likes.count() + self.comments.count() * settings.FEED_WEIGHT['comment_weight']
-        age_in_hours = (datetime.now(timezone.utc) - self.pub_date).total_seconds() / (60 * 60)
-        self.weight = score / pow(age_in_hours + 2, settings.FEED_WEIGHT['gravity'])
+        "See stories2.ranking; update_feed recomputes weights for all entries in bulk"
+        self.weight = feed_weight(self.like_count, self.comment_count, self.pub_date)
+
+    def save(self, *args, **kwargs):
+        """
+        New entries are weighted right away. Hot scores only depend on this row, so are always
+        kept current, from the counts as they are now. Counters are never written back.
+        """
+        if not self._state.adding and ranking_mode() == 'hot':
+            self.refresh_from_db(fields=self.counters)
+        if self._state.adding or ranking_mode() == 'hot':
+            self.update_weight()
+        super().save(*args, **without_counters(self, self.counters, kwargs))
 
     class Meta:
         ordering = ['-weight']
+        # Keyset pagination seeks on (weight, id) for the feed and (pub_date, id) for stories;
+        # conditional GETs aggregate updated_at over active entries
+        index_together = [('weight', 'id'), ('pub_date', 'id'), ('active', 'updated_at')]
 
 class Story(FeedEntry):
     "Represents a story published by a publication"
@@ -93,6 +122,17 @@ class StoryLike(models.Model):
     liker = models.ForeignKey('auth.User', related_name="liked_stories")
     story = models.ForeignKey(Story, related_name="likes")
 
+    class Meta:
+        unique_together = (('story', 'liker'),)
+
+class StoryFollow(models.Model):
+    "A user who gets notified of comments on a story without having commented"
+    follower = models.ForeignKey('auth.User', related_name="followed_stories")
+    story = models.ForeignKey(Story, related_name="follows")
+
+    class Meta:
+        unique_together = (('story', 'follower'),)
+
 class StoryImage(models.Model):
     story = models.ForeignKey(Story, related_name='images')
     source_url = models.URLField(null=True, blank=True)
@@ -141,6 +181,17 @@ class TopicLike(models.Model):
     liker = models.ForeignKey('auth.User', related_name="liked_topics")
     topic = models.ForeignKey(Topic, related_name="likes")
 
+    class Meta:
+        unique_together = (('topic', 'liker'),)
+
+class TopicFollow(models.Model):
+    "A user who gets notified of comments on a topic without having commented"
+    follower = models.ForeignKey('auth.User', related_name="followed_topics")
+    topic = models.ForeignKey(Topic, related_name="follows")
+
+    class Meta:
+        unique_together = (('topic', 'follower'),)
+
 # Used this foreign key strategy so that downstream objects (commentUpvotes) don't have to be subclassed
 # for FeedItems
 class Comment(models.Model):
@@ -150,6 +201,25 @@ class Comment(models.Model):
     text = models.TextField()
     pub_date = models.DateTimeField()
     promoted = models.BooleanField(default=False)
+    upvote_count = models.IntegerField('Upvote Count', default=0, editable=False)
+    flag_count = models.IntegerField('Flag Count', default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    counters = ('upvote_count', 'flag_count')
+
+    class Meta:
+        index_together = [('pub_date', 'id'), ('story', 'pub_date', 'id'), ('topic', 'pub_date', 'id'),
+                ('story', 'author'), ('topic', 'author'),
+                # Conditional GETs of a thread aggregate updated_at
+                ('story', 'updated_at'), ('topic', 'updated_at'),
+                # ?ordering=top and ?ordering=promoted in a thread
+                ('story', 'upvote_count', 'pub_date', 'id'), ('topic', 'upvote_count', 'pub_date', 'id'),
+                ('story', 'promoted', 'upvote_count', 'pub_date', 'id'),
+                ('topic', 'promoted', 'upvote_count', 'pub_date', 'id')]
+
+    def save(self, *args, **kwargs):
+        "Counters are never written back"
+        super().save(*args, **without_counters(self, self.counters, kwargs))
 
     def clean(self):
         if self.story is None and self.topic is None:
@@ -173,19 +243,18 @@ class Comment(models.Model):
         )
 
 @receiver(models.signals.post_save, sender=Comment)
-def notify_discussion_participants(sender, instance, **kwargs):
-    """Send a push notification to all other commenters when a comment is created"""
-    subject = instance.story or instance.topic
-    authors = [c.author for c in subject.comments.all() if c.author != instance.author]
-    devices = APNSDevice.objects.filter(user__in=authors)
-    devices.send_message(None,  extra={
-        "aps":{
-            "alert": "New comment",
-            "sound": "default",
-            "badge": 1,
-            "deeplink": subject.ios_deeplink()
-        }
-    })
+def notify_discussion_participants(sender, instance, created, raw=False, **kwargs):
+    """
+    Queues a push notification to all other commenters and followers when a comment is created.
+    They are coalesced per user and thread, and sent by `manage.py send_notifications`; see stories2.outbox.
+    """
+    if created and not raw:
+        from stories2.outbox import enqueue
+        subject = instance.story or instance.topic
+        # Each is one query over the (story|topic, author) or unique (story|topic, follower) index
+        authors = subject.comments.exclude(author_id=instance.author_id).values_list('author_id', flat=True).distinct()
+        followers = subject.follows.exclude(follower_id=instance.author_id).values_list('follower_id', flat=True)
+        enqueue(set(authors) | set(followers), subject.ios_deeplink())
 
 class CommentUpvote(models.Model):
     "Records a single user's upvote of a single comment"
@@ -206,27 +275,229 @@ class CommentFlag(models.Model):
 
     class Meta:
         unique_together = (('comment', 'author'),)
-    
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
 
+class Notification(models.Model):
+    """
+    A push notification in the outbox, waiting to be sent by `manage.py send_notifications`.
+    Each stands for `count` new comments in one thread (deeplink) for one user.
+    """
+    STATUSES = (('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed'))
+    user = models.ForeignKey('auth.User', related_name="notifications")
+    alert = models.CharField(max_length=200)
+    deeplink = models.CharField(max_length=200)
+    count = models.IntegerField(default=1)
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    # True while pending and null afterwards, so the unique constraint allows one pending
+    # notification per user and thread, and any number of sent or failed ones
+    pending = models.NullBooleanField(default=True, editable=False)
+    attempts = models.IntegerField(default=0)
+    next_attempt = models.DateTimeField(default=now)
+    lease = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    # Space-separated tokens of devices already reached, which retries skip
+    delivered = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        # Workers claim due notifications by (status, next_attempt); new comments coalesce by thread
+        index_together = [('status', 'next_attempt')]
+        unique_together = [('deeplink', 'user', 'pending')]
 
+    def __str__(self):
+        return "{} to {} ({})".format(self.alert, self.user_id, self.status)
+
+class Change(models.Model):
+    """
+    One entry in the change sequence read by /v2/changes. Ids increase monotonically, so a
+    client can ask for everything after the last id it has seen.
+    """
+    KINDS = (('story', 'Story'), ('topic', 'Topic'), ('comment', 'Comment'))
+    ACTIONS = (
+        ('created', 'Created'),
+        ('updated', 'Updated'),
+        ('deactivated', 'Deactivated or deleted'),
+        ('counts', 'Counts changed'),
+    )
+    kind = models.CharField(max_length=10, choices=KINDS)
+    object_id = models.IntegerField()
+    action = models.CharField(max_length=12, choices=ACTIONS)
+    created_at = models.DateTimeField(auto_now_add=True)
 
+    def __str__(self):
+        return "{}: {} {} {}".format(self.id, self.kind, self.object_id, self.action)
+
+CHANGE_KINDS = {Story: 'story', Topic: 'topic', Comment: 'comment'}
+
+def record_change(kind, pk, action):
+    if pk is not None:
+        Change.objects.create(kind=kind, object_id=pk, action=action)
+
+def change_receivers(sender):
+    "Registers receivers recording the creation, update and deactivation of instances of sender"
+    @receiver(models.signals.post_save, sender=sender, weak=False)
+    def record_save(sender, instance, created, raw=False, **kwargs):
+        if not raw:
+            active = getattr(instance, 'active', True)
+            record_change(CHANGE_KINDS[sender], instance.pk,
+                    'created' if created else 'updated' if active else 'deactivated')
+
+    @receiver(models.signals.post_delete, sender=sender, weak=False)
+    def record_delete(sender, instance, **kwargs):
+        record_change(CHANGE_KINDS[sender], instance.pk, 'deactivated')
+
+change_receivers(Story)
+change_receivers(Topic)
+change_receivers(Comment)
+
+# Denormalized engagement counters. These are kept up to date atomically with F() expressions
+# as likes, comments, upvotes and flags come and go; `manage.py reconcile_counts` repairs drift.
+
+def adjust_count(model, pk, field, delta):
+    "Atomically adds delta to a counter column, without loading the row"
+    if pk is not None:
+        model._base_manager.filter(pk=pk).update(**{field: F(field) + delta, 'updated_at': now()})
+
+def count_receivers(sender, model, fk, field):
+    """
+    Registers receivers maintaining model.field as instances of sender are created and deleted.
+    Changes are recorded against the kind fk names (story_id -> story).
+    """
+    kind = fk[:-len('_id')]
+
+    @receiver(models.signals.post_save, sender=sender, weak=False)
+    def increment(sender, instance, created, raw=False, **kwargs):
+        if created and not raw:
+            adjust_count(model, getattr(instance, fk), field, 1)
+            record_change(kind, getattr(instance, fk), 'counts')
+
+    @receiver(models.signals.post_delete, sender=sender, weak=False)
+    def decrement(sender, instance, **kwargs):
+        adjust_count(model, getattr(instance, fk), field, -1)
+        record_change(kind, getattr(instance, fk), 'counts')
+
+def increment_counts(model, field, targets):
+    """
+    Adds one to a counter on many rows in one UPDATE, recording the changes and refreshing
+    weights and cached entries as the receivers would. For bulk inserts, which send no
+    signals. targets are (kind, pk) pairs, e.g. ('story', 5).
+    """
+    if not targets:
+        return
+    model._base_manager.filter(pk__in=[pk for kind, pk in targets]).update(**{field: F(field) + 1, 'updated_at': now()})
+    Change.objects.bulk_create([Change(kind=kind, object_id=pk, action='counts') for kind, pk in targets])
+    if model is FeedEntry:
+        refresh_weights([pk for kind, pk in targets])
+        for kind, pk in targets:
+            cache.bump(kind, pk)
+    if model is Comment:
+        events.counts_changed(pk for kind, pk in targets)
+
+count_receivers(StoryLike, FeedEntry, 'story_id', 'like_count')
+count_receivers(TopicLike, FeedEntry, 'topic_id', 'like_count')
+count_receivers(Comment, FeedEntry, 'story_id', 'comment_count')
+count_receivers(Comment, FeedEntry, 'topic_id', 'comment_count')
+count_receivers(CommentUpvote, Comment, 'comment_id', 'upvote_count')
+count_receivers(CommentFlag, Comment, 'comment_id', 'flag_count')
+
+# Live comment streams (see stories2.events)
 
+@receiver(models.signals.post_save, sender=Comment)
+def publish_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        events.comment_created(instance)
+
+@receiver(models.signals.post_save, sender=CommentUpvote)
+@receiver(models.signals.post_delete, sender=CommentUpvote)
+@receiver(models.signals.post_save, sender=CommentFlag)
+@receiver(models.signals.post_delete, sender=CommentFlag)
+def publish_comment_counts(sender, instance, raw=False, **kwargs):
+    if not raw and kwargs.get('created', True):
+        events.counts_changed([instance.comment_id])
+
+def reweight_receivers(sender, fk):
+    "Registers receivers refreshing the weight of an entry when its likes or comments change"
+    @receiver(models.signals.post_save, sender=sender, weak=False)
+    def reweight_on_save(sender, instance, created, raw=False, **kwargs):
+        if created and not raw:
+            refresh_weight(getattr(instance, fk))
+
+    @receiver(models.signals.post_delete, sender=sender, weak=False)
+    def reweight_on_delete(sender, instance, **kwargs):
+        refresh_weight(getattr(instance, fk))
+
+reweight_receivers(StoryLike, 'story_id')
+reweight_receivers(TopicLike, 'topic_id')
+reweight_receivers(Comment, 'story_id')
+reweight_receivers(Comment, 'topic_id')
+
+# Invalidation of the versioned object cache (see stories2.cache). Each receiver bumps the
+# version of every cached object whose payload shows the changed row.
+
+def invalidation_receivers(sender, targets):
+    "Registers receivers bumping the cached objects targets(instance) returns as (model name, pk) pairs"
+    @receiver(models.signals.post_save, sender=sender, weak=False)
+    def invalidate_on_save(sender, instance, raw=False, **kwargs):
+        if not raw:
+            for model_name, pk in targets(instance):
+                cache.bump(model_name, pk)
+
+    @receiver(models.signals.post_delete, sender=sender, weak=False)
+    def invalidate_on_delete(sender, instance, **kwargs):
+        for model_name, pk in targets(instance):
+            cache.bump(model_name, pk)
+
+invalidation_receivers(Publication, lambda i: [('publication', i.pk)])
+invalidation_receivers(Category, lambda i: [('category', i.pk)])
+invalidation_receivers(Story, lambda i: [('story', i.pk), ('publication', i.publisher_id)])
+invalidation_receivers(Topic, lambda i: [('topic', i.pk)])
+invalidation_receivers(StoryImage, lambda i: [('story', i.story_id)])
+invalidation_receivers(StoryLike, lambda i: [('story', i.story_id)])
+invalidation_receivers(TopicLike, lambda i: [('topic', i.topic_id)])
+invalidation_receivers(Comment, lambda i: [('story', i.story_id), ('topic', i.topic_id)])
+
+def m2m_invalidation_receiver(through, forward, backward):
+    """
+    Registers a receiver invalidating and touching both sides of a many-to-many relation as
+    links are added, removed or cleared. forward and backward are (model, accessor) pairs.
+    """
+    @receiver(models.signals.m2m_changed, sender=through, weak=False)
+    def invalidate_on_change(sender, instance, action, reverse, pk_set, **kwargs):
+        if action not in ('post_add', 'post_remove', 'pre_clear'):
+            return
+        (model, accessor), (related_model, _) = (backward, forward) if reverse else (forward, backward)
+        if action == 'pre_clear':
+            pk_set = list(getattr(instance, accessor).values_list('pk', flat=True))
+        if not pk_set: # e.g. re-adding existing links
+            return
+        touch(model, [instance.pk])
+        touch(related_model, pk_set)
+        cache.bump(model._meta.model_name, instance.pk)
+        for pk in pk_set:
+            cache.bump(related_model._meta.model_name, pk)
+
+m2m_invalidation_receiver(Story.categories.through, (Story, 'categories'), (Category, 'stories'))
+m2m_invalidation_receiver(Topic.stories.through, (Topic, 'stories'), (Story, 'topics'))
+
+# Related rows shown in a representation mark it as updated, for conditional GETs
+
+def touch(model, pks):
+    "Sets updated_at on rows whose representation changed without them being saved, recording the change"
+    model._base_manager.filter(pk__in=pks).update(updated_at=now())
+    if model in CHANGE_KINDS:
+        for pk in pks:
+            record_change(CHANGE_KINDS[model], pk, 'updated')
+
+def touch_receivers(sender, model, fk):
+    "Registers receivers touching the model row instances of sender point to as they are saved and deleted"
+    @receiver(models.signals.post_save, sender=sender, weak=False)
+    def touch_on_save(sender, instance, raw=False, **kwargs):
+        if not raw:
+            touch(model, [getattr(instance, fk)])
+
+    @receiver(models.signals.post_delete, sender=sender, weak=False)
+    def touch_on_delete(sender, instance, **kwargs):
+        touch(model, [getattr(instance, fk)])
+
+touch_receivers(Story, Publication, 'publisher_id')
+touch_receivers(StoryImage, Story, 'story_id')
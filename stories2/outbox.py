@@ -0,0 +1,156 @@
+"""
+The push notification outbox.
+
+Comment receivers only write Notification rows, so creating a comment never waits on APNS.
+Notifications are coalesced per user and thread: a new comment in a thread with a pending
+notification adds to its count, and a thread's first notification waits out
+NOTIFICATION_OUTBOX['window'] seconds to collect more. So one push, with an accurate count,
+goes out per active user and thread per window, however many comments there were.
+
+`manage.py send_notifications` drains the outbox: it claims a batch of due notifications
+under a lease (so several workers can run at once, and a crashed worker's batch is picked up
+again once the lease expires), sends them over a few APNS connections (see stories2.apns),
+and records the outcome. Failed sends are retried with exponential backoff until
+NOTIFICATION_OUTBOX['max_attempts'], to the devices which did not get them yet; devices whose
+tokens APNS rejects are deactivated.
+"""
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from django.utils.timezone import now
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from datetime import timedelta
+from push_notifications.models import APNSDevice
+from stories2 import apns
+from stories2.models import Notification
+import uuid
+
+def outbox_setting(key, default=None):
+    return getattr(settings, 'NOTIFICATION_OUTBOX', {}).get(key, default)
+
+def window():
+    return now() + timedelta(seconds=outbox_setting('window', 60))
+
+def new_notification(user_id, deeplink):
+    return Notification(user_id=user_id, alert="New comment", deeplink=deeplink, next_attempt=window())
+
+def add(user_id, deeplink):
+    """
+    Adds a new comment to the user's pending notification for the thread, or creates one.
+    A concurrent enqueue may create it first; the unique constraint on pending notifications
+    catches that, and the comment is added to theirs instead.
+    """
+    pending = Notification.objects.filter(deeplink=deeplink, user_id=user_id, pending=True)
+    while not pending.update(count=F('count') + 1):
+        try:
+            with transaction.atomic():
+                new_notification(user_id, deeplink).save()
+            return
+        except IntegrityError:
+            pass
+
+def enqueue(user_ids, deeplink):
+    """
+    Queues a new comment in the thread at deeplink for each user, adding to their pending
+    notification for the thread if they have one
+    """
+    user_ids = set(user_ids)
+    pending = Notification.objects.filter(deeplink=deeplink, pending=True, user_id__in=user_ids)
+    coalesced = set(pending.values_list('user_id', flat=True))
+    pending.update(count=F('count') + 1)
+    try:
+        with transaction.atomic():
+            Notification.objects.bulk_create([new_notification(user_id, deeplink) for user_id in user_ids - coalesced])
+    except IntegrityError: # A concurrent enqueue created some of them; add to those one at a time
+        for user_id in user_ids - coalesced:
+            add(user_id, deeplink)
+
+def backoff(attempts):
+    "Seconds to wait before retrying after `attempts` failed attempts"
+    return min(outbox_setting('backoff', 30) * 2 ** (attempts - 1), outbox_setting('max_backoff', 60 * 60))
+
+def claim(batch_size):
+    "Leases up to batch_size due notifications to this worker, and returns them"
+    lease = uuid.uuid4().hex
+    due = Notification.objects.filter(status='pending', next_attempt__lte=now())
+    ids = list(due.order_by('next_attempt', 'id').values_list('id', flat=True)[:batch_size])
+    # Another worker may claim some of these first; the next_attempt condition makes that safe
+    due.filter(id__in=ids).update(lease=lease, next_attempt=now() + timedelta(seconds=outbox_setting('lease', 300)))
+    return list(Notification.objects.filter(lease=lease))
+
+def alert(notification):
+    if notification.count == 1:
+        return notification.alert
+    return "{} new comments".format(notification.count)
+
+def payload(notification):
+    return {
+        "aps": {
+            "alert": alert(notification),
+            "sound": "default",
+            "badge": notification.count,
+            "deeplink": notification.deeplink
+        }
+    }
+
+def send(notifications, devices):
+    """
+    Sends notifications over one connection to their users' devices which haven't had them yet,
+    without touching the database. Returns ({notification id: error}, rejected tokens,
+    {notification id: tokens delivered to}).
+    """
+    messages = [(n, token) for n in notifications for token in devices.get(n.user_id, [])
+            if token not in n.delivered.split()]
+    try:
+        failures = apns.deliver([(token, payload(n)) for n, token in messages])
+    except Exception as e:
+        return {n.id: e for n in notifications}, [], {}
+    errors, rejected, delivered = {}, [], defaultdict(list)
+    for i, (notification, token) in enumerate(messages):
+        status = failures.get(i)
+        if status is None:
+            delivered[notification.id].append(token)
+        elif status in apns.REJECTED_TOKEN_STATUSES:
+            rejected.append(token)
+        else:
+            errors[notification.id] = apns.DeliveryError("APNS status {}".format(status))
+    return errors, rejected, delivered
+
+def record(notification, error, delivered=()):
+    if error is None:
+        sent = Notification.objects.filter(id=notification.id, count=notification.count).update(
+                status='sent', pending=None, sent_at=now(), lease='', attempts=F('attempts') + 1, delivered='')
+        if not sent: # More comments were coalesced in while sending; they go out next window
+            Notification.objects.filter(id=notification.id).update(count=F('count') - notification.count,
+                    lease='', next_attempt=window(), delivered='')
+        return 'sent'
+    attempts = notification.attempts + 1
+    failed = attempts >= outbox_setting('max_attempts', 5)
+    Notification.objects.filter(id=notification.id).update(attempts=attempts, lease='', last_error=repr(error),
+            status='failed' if failed else 'pending', pending=None if failed else True, next_attempt=now() + timedelta(seconds=backoff(attempts)),
+            delivered=' '.join(notification.delivered.split() + list(delivered)))
+    return 'failed' if failed else 'retrying'
+
+def drain(batch_size=100, concurrency=8):
+    """
+    Sends one batch of due notifications. Returns {outcome: count} for 'sent', 'retrying'
+    and 'failed'; empty when nothing was due.
+    """
+    notifications = claim(batch_size)
+    devices = defaultdict(list)
+    rows = APNSDevice.objects.filter(user_id__in={n.user_id for n in notifications}, active=True)
+    for user_id, registration_id in rows.values_list('user_id', 'registration_id'):
+        devices[user_id].append(registration_id)
+    errors, rejected, delivered = {}, [], {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for chunk_errors, chunk_rejected, chunk_delivered in pool.map(lambda chunk: send(chunk, devices),
+                [notifications[i::concurrency] for i in range(concurrency)]):
+            errors.update(chunk_errors)
+            rejected += chunk_rejected
+            delivered.update(chunk_delivered)
+    apns.deactivate(rejected)
+    outcomes = defaultdict(int)
+    for notification in notifications:
+        outcomes[record(notification, errors.get(notification.id), delivered.get(notification.id, ()))] += 1
+    return dict(outcomes)
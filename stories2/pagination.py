@@ -0,0 +1,137 @@
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+from django.db.models import Q
+from collections import OrderedDict
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+import json
+
+def keyset_requested(request):
+    "Clients opt into keyset pagination per request, with ?pagination=cursor or by sending a cursor"
+    return 'cursor' in request.query_params or request.query_params.get('pagination') == 'cursor'
+
+class KeysetPagination(BasePagination):
+    """
+    Opaque cursor pagination, descending on (the view's `keyset_field`, id). Each page seeks
+    past the last row of the one before, so deep pages cost the same as the first and rows
+    don't shift between pages when the ordering changes.
+    """
+    cursor_query_param = 'cursor'
+    limit_query_param = 'limit'
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.field = view.keyset_field
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request, queryset.model)
+        reverse = bool(cursor and cursor[2])
+        if cursor:
+            value, pk = cursor[0], cursor[1]
+            past = '__gt' if reverse else '__lt'
+            queryset = queryset.filter(Q(**{self.field + past: value}) | Q(**{self.field: value, 'id' + past: pk}))
+        ordering = (self.field, 'id') if reverse else ('-' + self.field, '-id')
+        rows = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+        self.has_next = bool(rows) and (reverse or more)
+        self.has_previous = bool(rows) and (more if reverse else cursor is not None)
+        self.rows = rows
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.limit_query_param])
+            if size > 0:
+                return min(size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def position(self, row):
+        if isinstance(row, dict):
+            return row[self.field], row['id']
+        return getattr(row, self.field), row.id
+
+    def encode_cursor(self, row, reverse):
+        value, pk = self.position(row)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        token = urlsafe_b64encode(json.dumps([value, pk, reverse]).encode('ascii')).decode('ascii')
+        url = remove_query_param(self.request.build_absolute_uri(), 'pagination')
+        return replace_query_param(url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request, model):
+        "Returns (value, id, reverse), or None for the first page"
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            value, pk, reverse = json.loads(urlsafe_b64decode(token.encode('ascii')).decode('ascii'))
+            value = model._meta.get_field(self.field).to_python(value)
+            return value, int(pk), bool(reverse)
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        return self.encode_cursor(self.rows[-1], False) if self.has_next else None
+
+    def get_previous_link(self):
+        return self.encode_cursor(self.rows[0], True) if self.has_previous else None
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+class OffsetOrKeysetPagination(LimitOffsetPagination):
+    "Limit/offset pagination by default, or keyset pagination for clients which ask for it"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = KeysetPagination() if keyset_requested(request) else None
+        if self.keyset:
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_next_link(self):
+        if self.keyset:
+            return self.keyset.get_next_link()
+        return super().get_next_link()
+
+    def get_previous_link(self):
+        if self.keyset:
+            return self.keyset.get_previous_link()
+        return super().get_previous_link()
+
+    def get_paginated_response(self, data):
+        if self.keyset:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+class SnapshotPagination(OffsetOrKeysetPagination):
+    "Limit/offset pagination over a feed snapshot. Next and previous links pin the snapshot version."
+    snapshot_query_param = 'snapshot'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.version = getattr(queryset, 'version', None)
+        return super().paginate_queryset(queryset, request, view)
+
+    def pin(self, url):
+        if url is None or self.version is None:
+            return url
+        return replace_query_param(url, self.snapshot_query_param, self.version)
+
+    def get_next_link(self):
+        return self.pin(super().get_next_link())
+
+    def get_previous_link(self):
+        return self.pin(super().get_previous_link())
@@ -0,0 +1,168 @@
+"""
+Feed ranking.
+
+Two modes are available, selected by FEED_WEIGHT['mode']:
+
+- 'gravity' (default): the Hacker News gravity formula. Weights decay with age, so update_feed
+  needs to run periodically.
+- 'hot': a Reddit-style, time-invariant score in log space. An entry's weight only changes when
+  it is liked or commented on, and is refreshed then; update_feed is only needed after changing
+  the settings.
+
+Weights are recomputed in bulk: feed entries (with their denormalized like and comment counts)
+are streamed from the base table a chunk at a time into arrays, scored in one NumPy pass, and
+only the weights which have moved by more than the configured tolerance are written back, in a
+single transaction.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, When, Value, FloatField
+from datetime import datetime, timezone
+import numpy as np
+
+# Hot scores count time from here, to keep them small
+HOT_EPOCH = datetime(2017, 1, 1, tzinfo=timezone.utc).timestamp()
+
+# SQLite allows 999 parameters per statement; each row of a bulk update uses three.
+WRITE_BATCH_SIZE = 300
+READ_CHUNK_SIZE = 2000
+
+def feed_weight_setting(key, default=None):
+    return settings.FEED_WEIGHT.get(key, default)
+
+def ranking_mode():
+    return feed_weight_setting('mode', 'gravity')
+
+def to_timestamps(dates):
+    "Converts a sequence of aware datetimes to an array of POSIX timestamps"
+    if isinstance(dates, np.ndarray) and dates.dtype.kind == 'f':
+        return dates
+    return np.fromiter((d.timestamp() for d in dates), dtype=float, count=len(dates))
+
+# Using Hacker News gravity algorithm:
+# https://medium.com/hacking-and-gonzo/how-hacker-news-ranking-algorithm-works-1d9b0cf2c08d
+def gravity_weights(pub_dates, like_counts, comment_counts, now=None):
+    """
+    Computes the weights of many feed entries at once. pub_dates may be datetimes or
+    POSIX timestamps. Entries dated in the future are treated as brand new.
+    """
+    now = now or datetime.now(timezone.utc)
+    score = 1 + np.asarray(like_counts, dtype=float) + \
+            np.asarray(comment_counts, dtype=float) * settings.FEED_WEIGHT['comment_weight']
+    age_in_hours = np.maximum(now.timestamp() - to_timestamps(pub_dates), 0) / (60 * 60)
+    return score / np.power(age_in_hours + 2, settings.FEED_WEIGHT['gravity'])
+
+def hot_weights(pub_dates, like_counts, comment_counts, now=None):
+    """
+    Computes time-invariant hot scores: log2 of the engagement score plus the publication time
+    in half-lives. An entry published one half-life later needs half the engagement to rank
+    equally, so ordering by this score matches a decaying score without ever recomputing.
+    """
+    half_life = feed_weight_setting('half_life', 12) * 60 * 60
+    score = 1 + np.asarray(like_counts, dtype=float) + \
+            np.asarray(comment_counts, dtype=float) * settings.FEED_WEIGHT['comment_weight']
+    return np.log2(score) + (to_timestamps(pub_dates) - HOT_EPOCH) / half_life
+
+def feed_weights(pub_dates, like_counts, comment_counts, now=None):
+    "Computes weights using the configured ranking mode"
+    weigh = hot_weights if ranking_mode() == 'hot' else gravity_weights
+    return weigh(pub_dates, like_counts, comment_counts, now)
+
+def feed_weight(like_count, comment_count, pub_date, now=None):
+    "Computes the weight of a single feed entry"
+    return float(feed_weights([pub_date], [like_count], [comment_count], now)[0])
+
+def weights_changed(old, new, tolerance):
+    "Whether each weight has moved enough (relative to its old value) to be worth writing"
+    return np.where(old != 0, np.abs(new - old) > tolerance * np.abs(old), new != old)
+
+def iter_feed_rows(chunk_size=READ_CHUNK_SIZE):
+    """
+    Yields chunks of (id, pub_date, weight, like_count, comment_count) tuples for every
+    feed entry. Each chunk is read in one query against the base table.
+    """
+    from stories2.models import FeedEntry
+    last_id = 0
+    while True:
+        chunk = list(FeedEntry.objects.non_polymorphic()
+            .filter(id__gt=last_id)
+            .order_by('id')
+            .values_list('id', 'pub_date', 'weight', 'like_count', 'comment_count')[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1][0]
+
+def load_feed_arrays(chunk_size=READ_CHUNK_SIZE):
+    "Reads the whole feed into a dict of arrays: ids, pub_dates (timestamps), weights, likes, comments"
+    columns = ([], [], [], [], [])
+    for chunk in iter_feed_rows(chunk_size):
+        for column, values in zip(columns, zip(*chunk)):
+            column.extend(values)
+    ids, pub_dates, weights, likes, comments = columns
+    return {
+        'ids': np.array(ids, dtype=np.int64),
+        'pub_dates': to_timestamps(pub_dates),
+        'weights': np.array(weights, dtype=float),
+        'likes': np.array(likes, dtype=float),
+        'comments': np.array(comments, dtype=float),
+    }
+
+def write_weights(changes):
+    "Writes (id, weight) pairs back to the feed entry table, one UPDATE per batch"
+    from stories2.models import FeedEntry
+    updated_at = datetime.now(timezone.utc)
+    for i in range(0, len(changes), WRITE_BATCH_SIZE):
+        batch = changes[i:i + WRITE_BATCH_SIZE]
+        FeedEntry.objects.non_polymorphic().filter(id__in=[pk for pk, w in batch]).update(
+            weight=Case(
+                *[When(id=pk, then=Value(w)) for pk, w in batch],
+                output_field=FloatField()
+            ),
+            updated_at=updated_at
+        )
+
+def refresh_weight(pk):
+    """
+    Recomputes one entry's weight after its likes or comments change. Only needed in hot
+    mode; gravity weights are left to update_feed.
+    """
+    if pk is not None:
+        refresh_weights([pk])
+
+def refresh_weights(pks):
+    "Recomputes the weights of many entries in hot mode, with one read and one UPDATE per batch"
+    from stories2.models import FeedEntry
+    if not pks or ranking_mode() != 'hot':
+        return
+    rows = list(FeedEntry.objects.non_polymorphic().filter(pk__in=pks)
+            .values_list('id', 'pub_date', 'like_count', 'comment_count'))
+    if rows:
+        ids, pub_dates, likes, comments = zip(*rows)
+        write_weights(list(zip(ids, feed_weights(pub_dates, likes, comments).tolist())))
+
+def recompute_weights(tolerance=None, chunk_size=READ_CHUNK_SIZE, now=None):
+    """
+    Recomputes the weight of every feed entry. Weights which would change by no more than
+    `tolerance` (a fraction of the old weight; defaults to FEED_WEIGHT['tolerance']) are
+    left alone; hot scores don't decay, so in hot mode every difference is written. All reads
+    happen before the write transaction is opened, so the database is only locked while the
+    changed rows are written. The feed snapshot is then rebuilt, and cached stories and topics
+    invalidated. Returns (entries scanned, entries updated).
+    """
+    from stories2 import snapshot, cache
+    if ranking_mode() == 'hot':
+        tolerance = 0
+    elif tolerance is None:
+        tolerance = feed_weight_setting('tolerance', 0)
+    feed = load_feed_arrays(chunk_size)
+    weights = feed_weights(feed['pub_dates'], feed['likes'], feed['comments'], now)
+    changed = weights_changed(feed['weights'], weights, tolerance)
+    changes = list(zip(feed['ids'][changed].tolist(), weights[changed].tolist()))
+    with transaction.atomic():
+        write_weights(changes)
+    snapshot.rebuild()
+    if changes:
+        cache.bump_all('story')
+        cache.bump_all('topic')
+    return len(feed['ids']), len(changes)
@@ -1,18 +1,79 @@
 from rest_framework import serializers
-from stories2.models import FeedEntry, Publication, Story, Topic, Category, Comment, StoryImage, CommentUpvote, CommentFlag, StoryLike, TopicLike
-from profiles2.models import Profile
+from stories2.models import FeedEntry, Publication, Story, Topic, Category, Comment, StoryImage, CommentUpvote, CommentFlag, StoryLike, TopicLike, StoryFollow, TopicFollow
 from profiles2.serializers import AuthTokenUserSerializer
+from profiles2.tokens import resolve_auth_token
+from stories2.actions import ACTION_TYPES, apply_actions
 from versatileimagefield.serializers import VersatileImageFieldSerializer
+from versatileimagefield.utils import build_versatileimagefield_url_set, get_rendition_key_set
 from django.contrib.auth.models import User
+from django.db import transaction, IntegrityError
 from django.db.models import Count
 from django.shortcuts import get_object_or_404
+from django.core.urlresolvers import reverse
 from django.http import Http404
 from datetime import datetime
 
-class PublicationSerializer(serializers.ModelSerializer):
+def sparse_fields(request, fields):
+    "Applies ?fields=a,b (keep only these) and ?omit=a,b (drop these) from a GET request to a list of field names"
+    if request is None or request.method != 'GET':
+        return list(fields)
+    keep = request.query_params.get('fields')
+    omit = request.query_params.get('omit')
+    if keep:
+        fields = [f for f in fields if f in keep.split(',')]
+    if omit:
+        fields = [f for f in fields if f not in omit.split(',')]
+    return list(fields)
+
+class SparseFieldsMixin:
+    "Lets clients choose which fields they receive, with ?fields= and ?omit="
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        kept = sparse_fields(self.context.get('request'), self.fields)
+        for name in list(self.fields):
+            if name not in kept:
+                self.fields.pop(name)
+
+class StoryListMixin:
+    """
+    Represents a relation to many stories by its size (a `story_count` the view annotates
+    or stores) and a link to the paginated nested listing, rather than by every story id.
+    Version 1 of the representation (?version=1) keeps the original `v1_fields`, which list
+    the ids in `stories`.
+    """
+    stories_route = None
+    stories_lookup = None
+    v1_fields = ()
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if getattr(request, 'version', None) == '1':
+            for name in list(fields):
+                if name not in self.v1_fields:
+                    fields.pop(name)
+        else:
+            fields.pop('stories')
+        return fields
+
+    def get_stories_url(self, obj):
+        request = self.context.get('request')
+        namespace = request.resolver_match.namespace if request and request.resolver_match else 'v2'
+        url = reverse('{}:{}'.format(namespace, self.stories_route),
+                kwargs={'parent_lookup_' + self.stories_lookup: obj.pk})
+        return request.build_absolute_uri(url) if request else url
+
+class PublicationSerializer(StoryListMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    story_count = serializers.IntegerField(read_only=True)
+    stories_url = serializers.SerializerMethodField()
+    stories_route = 'publication-stories-list'
+    stories_lookup = 'publisher'
+    v1_fields = ('id', 'name', 'url', 'feed_url', 'logo', 'stories')
+
     class Meta:
         model = Publication
-        fields = ('id', 'name', 'url', 'feed_url', 'logo', 'stories')
+        fields = ('id', 'name', 'url', 'feed_url', 'logo', 'stories', 'story_count', 'stories_url')
         read_only_fields = ('stories',)
 
 class StoryImageSerializer(serializers.ModelSerializer):
@@ -32,15 +93,9 @@ class FeedSerializer(serializers.ModelSerializer):
         model = FeedEntry
         fields = ('id', 'content_type')
 
-class FeedEntrySerializer(serializers.ModelSerializer):
-    comment_count = serializers.SerializerMethodField()
-    like_count = serializers.SerializerMethodField()
-
-    def get_comment_count(self, obj):
-        return obj.comments.count()
-
-    def get_like_count(self, obj):
-        return obj.likes.count()
+class FeedEntrySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    comment_count = serializers.IntegerField(read_only=True)
+    like_count = serializers.IntegerField(read_only=True)
 
 class StorySerializer(FeedEntrySerializer):
     images = StoryImageSerializer(many=True, read_only=True)
@@ -54,31 +109,58 @@ class StorySerializer(FeedEntrySerializer):
         fields = ('id', 'title', 'weight', 'publisher', 'pub_id', 'pub_date', 'authors', 
                 'comment_count', 'content', 'text', 'images', 'flat_image_urls', 'categories', 'like_count')
 
-class TopicSerializer(FeedEntrySerializer):
+class TopicSerializer(StoryListMixin, FeedEntrySerializer):
+    story_count = serializers.IntegerField(read_only=True)
+    stories_url = serializers.SerializerMethodField()
+    stories_route = 'topic-stories-list'
+    stories_lookup = 'topics'
+    v1_fields = ('id', 'title', 'weight', 'pub_date', 'stories', 'comment_count', 'like_count')
+
     class Meta: 
         model = Topic
-        fields = ('id', 'title', 'weight', 'pub_date', 'stories', 'comment_count', 'like_count')
+        fields = ('id', 'title', 'weight', 'pub_date', 'stories', 'story_count', 'stories_url', 'comment_count', 'like_count')
+
+class StorySummarySerializer(FeedEntrySerializer):
+    """
+    A lightweight story representation for lists. The excerpt is annotated by the view
+    (see StoryViewSet), so the full content and text are never read.
+    """
+    thumbnail = serializers.SerializerMethodField()
+    excerpt = serializers.CharField(read_only=True)
+
+    def get_thumbnail(self, obj):
+        images = obj.images.all()
+        if not images:
+            return None
+        urls = build_versatileimagefield_url_set(images[0].image, get_rendition_key_set('story_image'),
+                request=self.context.get('request'))
+        return urls.get('thumb')
+
+    class Meta:
+        model = Story
+        fields = ('id', 'title', 'publisher', 'pub_date', 'thumbnail', 'comment_count', 'like_count', 'excerpt')
+
+class CategorySerializer(StoryListMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    stories_url = serializers.SerializerMethodField()
+    stories_route = 'category-stories-list'
+    stories_lookup = 'categories'
+    v1_fields = ('id', 'name', 'stories', 'story_count')
 
-class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = ('id', 'name', 'stories', 'story_count')
+        fields = ('id', 'name', 'stories', 'story_count', 'stories_url')
         read_only_fields = ('story_count',)
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     "A comment serializer"
-    upvotes = serializers.SerializerMethodField()
-    flags = serializers.SerializerMethodField()
-
-    def get_upvotes(self, obj):
-        return obj.upvotes.count()
-
-    def get_flags(self, obj):
-        return obj.flags.count()
+    author_username = serializers.CharField(source='author.profile.username', read_only=True)
+    upvotes = serializers.IntegerField(source='upvote_count', read_only=True)
+    flags = serializers.IntegerField(source='flag_count', read_only=True)
 
     class Meta:
         model = Comment
-        fields = ('id', 'author', 'story', 'topic', 'text', 'pub_date', 'upvotes', 'flags', 'promoted')
+        fields = ('id', 'author', 'author_username', 'story', 'topic', 'text', 'pub_date', 'upvotes', 'flags',
+                'promoted')
 
 class AuthTokenCommentSerializer(serializers.Serializer):
     "A comment serializer which requires auth_tokens for destrictive actions"
@@ -93,9 +175,7 @@ class AuthTokenCommentSerializer(serializers.Serializer):
         return value
 
     def validate(self, data):
-        try:
-            profile = Profile.objects.get(auth_token=data['auth_token'])
-        except Profile.DoesNotExist:
+        if resolve_auth_token(data['auth_token'], self.context.get('request')) is None:
             raise serializers.ValidationError("Invalid auth token")
 
         if data['story'] is None and data['topic'] is None:
@@ -105,9 +185,8 @@ class AuthTokenCommentSerializer(serializers.Serializer):
         return data
 
     def create(self, validated_data):
-        profile = Profile.objects.get(auth_token=validated_data['auth_token'])
         comment = Comment(
-            author = profile.user,
+            author = resolve_auth_token(validated_data['auth_token'], self.context.get('request')),
             story = get_object_or_404(Story, pk=validated_data['story']) if validated_data['story'] else None,
             topic = get_object_or_404(Topic, pk=validated_data['topic']) if validated_data['topic'] else None,
             text = validated_data['text'],
@@ -116,74 +195,111 @@ class AuthTokenCommentSerializer(serializers.Serializer):
         comment.save()
         return comment
 
+def insert_or_get(model, **fields):
+    """
+    Inserts a row, or returns the existing one when a unique constraint shows this is a
+    repeat. Unlike get_or_create, the common case is a single INSERT. Returns (row, created).
+    """
+    try:
+        with transaction.atomic():
+            return model.objects.create(**fields), True
+    except IntegrityError:
+        return model.objects.get(**fields), False
+
 class AuthTokenStoryLikeSerializer(AuthTokenUserSerializer):
-    "Translates an auth token into a story like" 
+    "Translates an auth token into a story like. Liking again returns the existing like (see `created`)."
     story = serializers.PrimaryKeyRelatedField(queryset=Story.objects.all())
 
-    def validate(self, data):
-        if data['story'].likes.filter(liker__profile__auth_token=data['auth_token']).exists():
-            raise serializers.ValidationError("User has already liked this story")
-        return data
-
     def create(self, validated_data):
-        like = StoryLike(
-            liker=Profile.objects.get(auth_token=validated_data['auth_token']).user,
+        like, self.created = insert_or_get(StoryLike,
+            liker=self.token_user(validated_data['auth_token']),
             story=validated_data['story']
         )
-        like.save()
         return like
 
 class AuthTokenTopicLikeSerializer(AuthTokenUserSerializer):
-    "Translates an auth token into a topic like" 
+    "Translates an auth token into a topic like. Liking again returns the existing like (see `created`)."
     topic = serializers.PrimaryKeyRelatedField(queryset=Topic.objects.all())
 
-    def validate(self, data):
-        if data['topic'].likes.filter(liker__profile__auth_token=data['auth_token']).exists():
-            raise serializers.ValidationError("User has already liked this topic")
-        return data
-
     def create(self, validated_data):
-        like = TopicLike(
-            liker=Profile.objects.get(auth_token=validated_data['auth_token']).user,
+        like, self.created = insert_or_get(TopicLike,
+            liker=self.token_user(validated_data['auth_token']),
             topic=validated_data['topic']
         )
-        like.save()
         return like
 
+class AuthTokenStoryFollowSerializer(AuthTokenUserSerializer):
+    "Translates an auth token into a story follow. Following again returns the existing follow."
+    story = serializers.PrimaryKeyRelatedField(queryset=Story.objects.all())
+
+    def create(self, validated_data):
+        follow, self.created = insert_or_get(StoryFollow,
+            follower=self.token_user(validated_data['auth_token']),
+            story=validated_data['story']
+        )
+        return follow
+
+    def unfollow(self):
+        StoryFollow.objects.filter(follower=self.token_user(self.validated_data['auth_token']),
+                story=self.validated_data['story']).delete()
+
+class AuthTokenTopicFollowSerializer(AuthTokenUserSerializer):
+    "Translates an auth token into a topic follow. Following again returns the existing follow."
+    topic = serializers.PrimaryKeyRelatedField(queryset=Topic.objects.all())
+
+    def create(self, validated_data):
+        follow, self.created = insert_or_get(TopicFollow,
+            follower=self.token_user(validated_data['auth_token']),
+            topic=validated_data['topic']
+        )
+        return follow
+
+    def unfollow(self):
+        TopicFollow.objects.filter(follower=self.token_user(self.validated_data['auth_token']),
+                topic=self.validated_data['topic']).delete()
+
 class AuthTokenCommentUpvoteSerializer(AuthTokenUserSerializer):
-    "Translates an auth token into a CommentUpvote"
+    "Translates an auth token into a CommentUpvote. Upvoting again returns the existing upvote."
     comment = serializers.PrimaryKeyRelatedField(queryset=Comment.objects.all())
 
     def validate(self, data):
-        comment = data['comment']
-        if comment.upvotes.filter(author__profile__auth_token=data['auth_token']).exists():
-           raise serializers.ValidationError("User has already upvoted this comment") 
-        if hasattr(comment.author, 'profile') and comment.author.profile.auth_token == data['auth_token']:
+        if data['comment'].author_id == self.token_user(data['auth_token']).id:
             raise serializers.ValidationError("Users may not upvote their own comments")
         return data
 
     def create(self, validated_data):
-        upvote = CommentUpvote(
-            author=Profile.objects.get(auth_token=validated_data['auth_token']).user,
+        upvote, self.created = insert_or_get(CommentUpvote,
+            author=self.token_user(validated_data['auth_token']),
             comment=validated_data['comment']
         )
-        upvote.save()
         return upvote
 
 class AuthTokenCommentFlagSerializer(AuthTokenUserSerializer):
-    "Translates an auth token into a CommentFlag"
+    "Translates an auth token into a CommentFlag. Flagging again returns the existing flag."
     comment = serializers.PrimaryKeyRelatedField(queryset=Comment.objects.all())
 
-    def validate(self, data):
-        comment = data['comment']
-        if comment.flags.filter(author__profile__auth_token=data['auth_token']).exists():
-           raise serializers.ValidationError("User has already flagged this comment") 
-        return data
-
     def create(self, validated_data):
-        flag = CommentFlag(
-            author=Profile.objects.get(auth_token=validated_data['auth_token']).user,
+        flag, self.created = insert_or_get(CommentFlag,
+            author=self.token_user(validated_data['auth_token']),
             comment=validated_data['comment']
         )
-        flag.save()
         return flag
+
+class ActionSerializer(serializers.Serializer):
+    "One queued engagement: a like of a story or topic, or an upvote or flag of a comment"
+    type = serializers.ChoiceField(choices=list(ACTION_TYPES))
+    id = serializers.IntegerField()
+
+class AuthTokenActionsSerializer(AuthTokenUserSerializer):
+    "Applies a batch of engagement actions for one user (see stories2.actions)"
+    actions = ActionSerializer(many=True)
+    max_actions = 200
+
+    def validate_actions(self, value):
+        if len(value) > self.max_actions:
+            raise serializers.ValidationError("At most {} actions may be sent at once".format(self.max_actions))
+        return value
+
+    def create(self, validated_data):
+        self.results = apply_actions(self.token_user(validated_data['auth_token']), validated_data['actions'])
+        return self.results
@@ -0,0 +1,79 @@
+"""
+Materialized feed.
+
+The ranked feed is kept as an ordered list of (id, content type) pairs, in the cache and in
+process memory, so listing the feed slices a list rather than querying the database. The
+snapshot is rebuilt after each weight recomputation, and lazily once it is older than
+FEED_SNAPSHOT['max_age'] seconds.
+
+Each rebuild gets a new version number. Older versions stay available for
+FEED_SNAPSHOT['keep'] seconds, so a client paging through the feed (the next and previous
+links carry the version) sees a stable ordering even if the feed is rebuilt meanwhile. With
+the default local-memory cache each process keeps its own snapshots; configure a shared
+cache backend to share them between processes.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.contenttypes.models import ContentType
+
+VERSION_KEY = 'feed_snapshot:version'
+CURRENT_KEY = 'feed_snapshot:current'
+KEEP_IN_MEMORY = 3
+
+_snapshots = {}
+
+class Snapshot(list):
+    "A list of (id, content type) pairs, in feed order, with a version number"
+    def __init__(self, entries, version):
+        super().__init__(entries)
+        self.version = version
+
+def snapshot_setting(key, default=None):
+    return getattr(settings, 'FEED_SNAPSHOT', {}).get(key, default)
+
+def snapshot_key(version):
+    return 'feed_snapshot:{}'.format(version)
+
+def content_type_name(ctype_id):
+    "Maps a polymorphic content type id to a model name, using the content type cache"
+    return ContentType.objects.get_for_id(ctype_id).model_class().__name__
+
+def ranked_entries():
+    "Reads the ranked feed from the base table, in one query"
+    from stories2.models import FeedEntry
+    rows = FeedEntry.objects.non_polymorphic().order_by('-weight', '-id').values_list('id', 'polymorphic_ctype_id')
+    return [(pk, content_type_name(ctype_id)) for pk, ctype_id in rows]
+
+def remember(snapshot):
+    "Keeps a snapshot in process memory, along with the few most recent others"
+    _snapshots[snapshot.version] = snapshot
+    for version in sorted(_snapshots)[:-KEEP_IN_MEMORY]:
+        _snapshots.pop(version, None)
+    return snapshot
+
+def rebuild():
+    "Builds a new snapshot of the feed and makes it current"
+    entries = ranked_entries()
+    cache.add(VERSION_KEY, 0, None)
+    version = cache.incr(VERSION_KEY)
+    cache.set(snapshot_key(version), entries, snapshot_setting('keep', 60 * 60))
+    cache.set(CURRENT_KEY, version, snapshot_setting('max_age', 10 * 60))
+    return remember(Snapshot(entries, version))
+
+def load(version):
+    if version in _snapshots:
+        return _snapshots[version]
+    entries = cache.get(snapshot_key(version))
+    if entries is not None:
+        return remember(Snapshot(entries, version))
+
+def get_snapshot(version=None):
+    """
+    Returns the requested version of the feed if it is still available, and otherwise the
+    current version, building one if there is none.
+    """
+    snapshot = load(version) if version is not None else None
+    if snapshot is None:
+        current = cache.get(CURRENT_KEY)
+        snapshot = load(current) if current is not None else None
+    return snapshot or rebuild()
@@ -1,3 +1,63 @@
 from django.test import TestCase
+from django.core.cache import cache
+from django.contrib.contenttypes.models import ContentType
+from datetime import datetime, timedelta, timezone
+from stories2.models import Publication, Story, Topic
+from stories2 import snapshot
 
-# Create your tests here.
+class FeedQueryCountTests(TestCase):
+    "A page of the feed is read from the base table alone, without polymorphic child queries"
+
+    def setUp(self):
+        cache.clear()
+        snapshot._snapshots.clear()
+        ContentType.objects.get_for_models(Story, Topic)
+        pub = Publication.objects.create(name='Campanile', url='http://example.com',
+                feed_url='http://example.com/feed', logo='logo.png')
+        now = datetime.now(timezone.utc)
+        for i in range(30):
+            Story.objects.create(title='Story {}'.format(i), publisher=pub, pub_id=i, authors='',
+                    content='', text='', pub_date=now - timedelta(hours=i))
+            Topic.objects.create(title='Topic {}'.format(i), pub_date=now - timedelta(hours=i))
+
+    def test_cursor_page_costs_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/v2/feed?pagination=cursor')
+        results = response.json()['results']
+        self.assertEqual(len(results), 20)
+        self.assertEqual({r['content_type'] for r in results}, {'Story', 'Topic'})
+        with self.assertNumQueries(1):
+            response = self.client.get(response.json()['next'])
+        self.assertEqual(len(response.json()['results']), 20)
+
+    def test_snapshot_page_costs_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/v2/feed')
+        self.assertEqual(response.json()['count'], 60)
+        with self.assertNumQueries(0):
+            response = self.client.get(response.json()['next'])
+        self.assertEqual(len(response.json()['results']), 20)
+
+class PublicationQueryCountTests(TestCase):
+    "Both versions of the publication list cost a constant number of queries, however many stories there are"
+
+    def setUp(self):
+        cache.clear()
+        pub = Publication.objects.create(name='Campanile', url='http://example.com',
+                feed_url='http://example.com/feed', logo='logo.png')
+        now = datetime.now(timezone.utc)
+        for i in range(30):
+            Story.objects.create(title='Story {}'.format(i), publisher=pub, pub_id=i, authors='',
+                    content='', text='', pub_date=now - timedelta(hours=i), active=i % 10 != 0)
+
+    def test_story_count_matches_listing(self):
+        publication = self.client.get('/v2/publications').json()['results'][0]
+        self.assertEqual(publication['story_count'], 27)
+        self.assertEqual(self.client.get(publication['stories_url']).json()['count'], 27)
+
+    def test_version_1_costs_constant_queries(self):
+        with self.assertNumQueries(4):
+            response = self.client.get('/v2/publications?version=1')
+        self.assertEqual(len(response.json()['results'][0]['stories']), 30)
+        with self.assertNumQueries(3):
+            self.client.get('/v2/publications')
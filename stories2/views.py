@@ -1,34 +1,314 @@
 from rest_framework import viewsets, status, generics
-from stories2.models import FeedEntry, Publication, Story, Topic, Category, Comment, CommentUpvote, CommentFlag
-from stories2.serializers import FeedSerializer, PublicationSerializer, StorySerializer, TopicSerializer, CategorySerializer, CommentSerializer, AuthTokenCommentSerializer, AuthTokenCommentUpvoteSerializer,AuthTokenCommentFlagSerializer, AuthTokenStoryLikeSerializer, AuthTokenTopicLikeSerializer
+from stories2.models import FeedEntry, Publication, Story, Topic, Category, Comment, CommentUpvote, CommentFlag, Change
+from stories2.serializers import sparse_fields, FeedSerializer, PublicationSerializer, StorySerializer, StorySummarySerializer, TopicSerializer, CategorySerializer, CommentSerializer, AuthTokenCommentSerializer, AuthTokenCommentUpvoteSerializer,AuthTokenCommentFlagSerializer, AuthTokenStoryLikeSerializer, AuthTokenTopicLikeSerializer, AuthTokenStoryFollowSerializer, AuthTokenTopicFollowSerializer, AuthTokenActionsSerializer
+from stories2.pagination import SnapshotPagination, OffsetOrKeysetPagination, keyset_requested
+from stories2.snapshot import get_snapshot, content_type_name
+from stories2.cache import cached_payload, stats as cache_stats
+from stories2.conditional import ConditionalGetMixin, conditional_get, conditional_response, make_etag
+from stories2.events import EventStreamRenderer, stream as event_stream
+from stories2.changes import current_token, expired, changes_since, represent_changes
+from stories2.fastpath import STORY_FIELDS, COMMENT_FIELDS, story_values, represent_stories, comment_values, represent_comments
 from stories2.custom_permissions import IsAdminOrReadOnly, IsAuthorOrAdminOrReadOnly
-from rest_framework.permissions import IsAuthenticated, AllowAny, SAFE_METHODS
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny, SAFE_METHODS
 from django.shortcuts import get_object_or_404
+from django.http import Http404, StreamingHttpResponse
+from django.db import connection
 from rest_framework.response import Response
+from rest_framework.exceptions import ParseError
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.views import APIView
 from rest_framework_extensions.mixins import NestedViewSetMixin
 from rest_framework.decorators import detail_route
+from rest_framework.versioning import QueryParameterVersioning
 from rest_framework import mixins
 from django.core.exceptions import ValidationError, NON_FIELD_ERRORS
-from django.db.models import Count
+from django.db.models import Max, Prefetch, QuerySet, Sum, Case, When, IntegerField
+from django.db.models.functions import Substr
+from collections import defaultdict, OrderedDict
+
+def with_story_relations(queryset):
+    "Prefetches everything StorySerializer reads, so a page of stories costs a constant number of queries"
+    return queryset.prefetch_related('images', Prefetch('categories', queryset=Category.objects.only('id')))
+
+def with_story_count(queryset):
+    "Annotates story_count with the number of active stories, which is what the nested story listings show"
+    return queryset.annotate(story_count=Sum(Case(When(stories__active=True, then=1), default=0,
+            output_field=IntegerField())))
+
+def with_topic_relations(queryset):
+    "Annotates what TopicSerializer reads, so a page of topics costs a constant number of queries"
+    return with_story_count(queryset)
+
+def with_story_ids(queryset):
+    """
+    Prefetches the ids of related stories (through a plain queryset; polymorphic ones can't be
+    prefetch querysets). publisher_id is read too, or attaching stories to their publication
+    reloads it one story at a time.
+    """
+    return queryset.prefetch_related(Prefetch('stories', queryset=QuerySet(Story).only('id', 'publisher_id')))
+
+class StoryListVersioning(QueryParameterVersioning):
+    "?version=1 keeps the full list of story ids on publications, categories and topics"
+    default_version = '2'
+    allowed_versions = ('1', '2')
+
+class StoryListVersionMixin:
+    "Serves version 1 (story id lists) or version 2 (story counts and links) of the representation"
+    versioning_class = StoryListVersioning
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        return with_story_ids(queryset) if self.request.version == '1' else queryset
+
+class CachedRetrieveMixin:
+    """
+    Serves detail GETs from the versioned object cache (see stories2.cache). Responses carry
+    an X-Cache header of HIT or MISS.
+    """
+    cache_model_name = None
+
+    def retrieve(self, request, *args, **kwargs):
+        retrieve = super().retrieve
+        try:
+            pk = int(kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except ValueError:
+            return retrieve(request, *args, **kwargs)
+        data, hit = cached_payload(self.cache_model_name, pk, request.build_absolute_uri(),
+                lambda: retrieve(request, *args, **kwargs).data)
+        response = Response(data)
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+        return response
+
+class EventStreamMixin:
+    "Adds a stream route relaying new comments and comment counts as server-sent events (see stories2.events)"
+    stream_kind = None
+
+    @detail_route(methods=['get'], renderer_classes=[EventStreamRenderer])
+    def stream(self, request, pk):
+        try:
+            if not self.get_queryset().filter(pk=int(pk)).exists():
+                raise Http404
+            last_event_id = request.META.get('HTTP_LAST_EVENT_ID')
+            last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            raise Http404
+        connection.close() # Streams don't need the database while they wait
+        response = StreamingHttpResponse(event_stream((self.stream_kind, int(pk)), last_event_id),
+                content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+class MultiGetMixin:
+    """
+    Lists with ?ids=1,2,3 return just those objects, in the requested order and without
+    pagination, loaded in one IN query plus the usual prefetches. Unknown ids are left out.
+    """
+    ids_query_param = 'ids'
+    max_batch_size = 100
+
+    def requested_ids(self):
+        "Returns the requested ids, without duplicates, or None when this isn't a multi-get"
+        if not hasattr(self, '_requested_ids'):
+            self._requested_ids = None
+            param = self.request.query_params.get(self.ids_query_param)
+            if self.action == 'list' and param is not None:
+                try:
+                    ids = [int(pk) for pk in param.split(',') if pk.strip()]
+                except ValueError:
+                    raise ParseError("?{} must be a comma-separated list of ids".format(self.ids_query_param))
+                ids = list(OrderedDict.fromkeys(ids))
+                if len(ids) > self.max_batch_size:
+                    raise ParseError("At most {} ids may be requested at once".format(self.max_batch_size))
+                self._requested_ids = ids
+        return self._requested_ids
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        ids = self.requested_ids()
+        return queryset if ids is None else queryset.filter(pk__in=ids)
+
+    def paginate_queryset(self, queryset):
+        ids = self.requested_ids()
+        if ids is None:
+            return super().paginate_queryset(queryset)
+        rows = {(row['id'] if isinstance(row, dict) else row.pk): row for row in queryset}
+        return [rows[pk] for pk in ids if pk in rows]
+
+    def get_paginated_response(self, data):
+        if self.requested_ids() is None:
+            return super().get_paginated_response(data)
+        return Response(data)
+
+class CacheStatsView(APIView):
+    "Reports this process's object cache hits and misses"
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(cache_stats())
+
+def expand_feed_page(page, context):
+    """
+    Replaces (id, content type) pairs with full story and topic payloads. Each content type
+    is loaded in one batch with its relations prefetched, so the number of queries doesn't
+    depend on the size of the page.
+    """
+    loaders = {
+        'Story': (with_story_relations(Story.objects.all()), StorySerializer),
+        'Topic': (with_topic_relations(Topic.objects.all()), TopicSerializer),
+    }
+    ids = defaultdict(list)
+    for pk, content_type in page:
+        ids[content_type].append(pk)
+    payloads = {}
+    for content_type, pks in ids.items():
+        queryset, serializer_class = loaders[content_type]
+        for data in serializer_class(queryset.filter(pk__in=pks), many=True, context=context).data:
+            payloads[data['id']] = dict(data, content_type=content_type)
+    return [payloads[pk] for pk, content_type in page if pk in payloads]
 
 class FeedViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
-    queryset = FeedEntry.objects.all()
+    """
+    Lists the feed from its materialized snapshot (see stories2.snapshot), or from the
+    database when paginating with cursors. Either way only the base table is read: the
+    content type comes from polymorphic_ctype_id rather than from child instances.
+    With ?expand=true, full story and topic payloads are returned inline.
+    """
+    queryset = FeedEntry.objects.non_polymorphic()
     serializer_class = FeedSerializer
+    pagination_class = SnapshotPagination
+    keyset_field = 'weight'
+
+    def get_queryset(self):
+        return super().get_queryset().values('id', 'weight', 'polymorphic_ctype_id')
+
+    def get_page(self, request):
+        "Returns the requested page of the feed as (id, content type) pairs"
+        if keyset_requested(request):
+            rows = self.paginate_queryset(self.get_queryset())
+            return [(row['id'], content_type_name(row['polymorphic_ctype_id'])) for row in rows]
+        try:
+            version = int(request.query_params['snapshot'])
+        except (KeyError, ValueError):
+            version = None
+        return self.paginate_queryset(get_snapshot(version))
+
+    def list(self, request, *args, **kwargs):
+        "Answers conditional GETs from the page of (id, content type) pairs, before expanding it"
+        page = self.get_page(request)
+        expand = request.query_params.get('expand') in ('true', '1')
+        last_modified = None
+        if expand:
+            last_modified = FeedEntry.objects.non_polymorphic().filter(
+                    pk__in=[pk for pk, content_type in page]).aggregate(Max('updated_at'))['updated_at__max']
+        etag = make_etag(request, page, self.paginator.get_next_link(), self.paginator.get_previous_link(),
+                last_modified)
+        return conditional_response(request, etag, last_modified, lambda: self.respond(page, expand))
+
+    def respond(self, page, expand):
+        if expand:
+            return self.get_paginated_response(expand_feed_page(page, self.get_serializer_context()))
+        return self.get_paginated_response([
+            {'id': pk, 'content_type': content_type} for pk, content_type in page
+        ])
+
+class ChangeViewSet(viewsets.GenericViewSet):
+    """
+    Lists what changed after ?since=<token> (see stories2.changes), a page at a time. Without
+    a token, returns the current one, to be taken before a full sync. A token older than the
+    retained changes gets 410 Gone, and the client must resync.
+    """
+    queryset = Change.objects.all()
+    page_size = 100
+    max_page_size = 500
 
-class PublicationViewSet(NestedViewSetMixin, viewsets.ModelViewSet):
+    def list(self, request, *args, **kwargs):
+        if 'since' not in request.query_params:
+            return Response(OrderedDict([('token', current_token()), ('next', None), ('results', [])]))
+        try:
+            since = int(request.query_params['since'])
+            limit = min(int(request.query_params.get('limit', self.page_size)), self.max_page_size)
+        except ValueError:
+            raise ParseError("?since and ?limit must be integers")
+        if expired(since):
+            return Response({'detail': "Changes since this token are no longer available; resync"},
+                    status=status.HTTP_410_GONE)
+        rows, more = changes_since(since, max(limit, 1))
+        token = rows[-1][-1] if rows else since
+        next_url = replace_query_param(request.build_absolute_uri(), 'since', token) if more else None
+        return Response(OrderedDict([('token', token), ('next', next_url), ('results', represent_changes(rows))]))
+
+class PublicationViewSet(ConditionalGetMixin, CachedRetrieveMixin, StoryListVersionMixin, NestedViewSetMixin, viewsets.ModelViewSet):
     "API endpoint allowing REST services for publications."
+    cache_model_name = 'publication'
     queryset = Publication.objects.filter(active=True)
     serializer_class = PublicationSerializer
     permission_classes = (IsAdminOrReadOnly,)
 
-class StoryViewSet(NestedViewSetMixin, viewsets.ModelViewSet):
-    "API endpoint allowing REST services for stories."
-    queryset = Story.objects.filter(active=True)
+    def get_queryset(self):
+        return with_story_count(super().get_queryset())
+
+class StoryViewSet(ConditionalGetMixin, MultiGetMixin, EventStreamMixin, CachedRetrieveMixin, NestedViewSetMixin, viewsets.ModelViewSet):
+    """
+    API endpoint allowing REST services for stories. ?view=summary gives a lightweight
+    representation; the heavy content and text columns are only read when they are sent.
+    """
+    stream_kind = 'story'
+    cache_model_name = 'story'
+    etag_fields = ('like_count', 'comment_count')
+    queryset = with_story_relations(Story.objects.filter(active=True))
     permission_classes = (AllowAny,) # TODO TROUBLE
+    pagination_class = OffsetOrKeysetPagination
+    keyset_field = 'pub_date'
+    excerpt_length = 200
+
+    def summary_requested(self):
+        return self.request.method == 'GET' and self.request.query_params.get('view') == 'summary'
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method != 'GET':
+            return queryset
+        if self.summary_requested() and self.action != 'list': # Lists read excerpts per page; see add_excerpts
+            queryset = queryset.annotate(excerpt=Substr('text', 1, self.excerpt_length))
+        fields = sparse_fields(self.request, self.get_serializer_class().Meta.fields)
+        deferred = [f for f in ('content', 'text') if f not in fields]
+        return queryset.defer(*deferred) if deferred else queryset
+
+    @conditional_get('list_validators')
+    def list(self, request, *args, **kwargs):
+        "Lists stories through the fast path (see stories2.fastpath), except for summaries"
+        if self.summary_requested():
+            queryset = self.filter_queryset(self.get_queryset())
+            page = self.paginate_queryset(queryset)
+            if page is not None:
+                return self.get_paginated_response(self.get_serializer(self.add_excerpts(page), many=True).data)
+            return Response(self.get_serializer(self.add_excerpts(list(queryset)), many=True).data)
+        fields = sparse_fields(request, STORY_FIELDS)
+        queryset = story_values(self.filter_queryset(self.get_queryset()), fields)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(represent_stories(page, request, fields))
+        return Response(represent_stories(list(queryset), request, fields))
+
+    def add_excerpts(self, stories):
+        """
+        Reads the excerpts of a page of stories in one query. Annotating the list queryset
+        instead would make pagination count every story's text too.
+        """
+        excerpts = dict(QuerySet(Story).filter(pk__in=[story.pk for story in stories])
+                .annotate(excerpt=Substr('text', 1, self.excerpt_length)).values_list('pk', 'excerpt'))
+        for story in stories:
+            story.excerpt = excerpts.get(story.pk)
+        return stories
 
     def get_serializer_class(self):
         if self.action == 'like':
             return AuthTokenStoryLikeSerializer
+        elif self.action in ('follow', 'unfollow'):
+            return AuthTokenStoryFollowSerializer
+        elif self.summary_requested():
+            return StorySummarySerializer
         else:
             return StorySerializer
 
@@ -38,17 +318,47 @@ class StoryViewSet(NestedViewSetMixin, viewsets.ModelViewSet):
         serializer = self.get_serializer(data=data)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        if not serializer.created:
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+    @detail_route(methods=['post'])
+    def follow(self, request, pk):
+        "Notifies the user of new comments, as if they had commented"
+        data = {"story": pk, "auth_token": self.request.data['auth_token']}
+        serializer = self.get_serializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        if not serializer.created:
+            return Response(serializer.data, status=status.HTTP_200_OK)
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
-class TopicViewSet(NestedViewSetMixin, viewsets.ModelViewSet):
+    @detail_route(methods=['post'])
+    def unfollow(self, request, pk):
+        data = {"story": pk, "auth_token": self.request.data['auth_token']}
+        serializer = self.get_serializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        serializer.unfollow()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class TopicViewSet(ConditionalGetMixin, MultiGetMixin, EventStreamMixin, CachedRetrieveMixin, StoryListVersionMixin, NestedViewSetMixin, viewsets.ModelViewSet):
     "API endpoint allowing REST services for topics."
+    cache_model_name = 'topic'
+    stream_kind = 'topic'
+    etag_fields = ('like_count', 'comment_count')
     queryset = Topic.objects.filter(active=True)
     permission_classes = (AllowAny,) # TODO TROUBLE
 
+    def get_queryset(self):
+        return with_topic_relations(super().get_queryset())
+
     def get_serializer_class(self):
         if self.action == 'like':
             return AuthTokenTopicLikeSerializer
+        elif self.action in ('follow', 'unfollow'):
+            return AuthTokenTopicFollowSerializer
         else:
             return TopicSerializer
 
@@ -58,19 +368,68 @@ class TopicViewSet(NestedViewSetMixin, viewsets.ModelViewSet):
         serializer = self.get_serializer(data=data)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        if not serializer.created:
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+    @detail_route(methods=['post'])
+    def follow(self, request, pk):
+        "Notifies the user of new comments, as if they had commented"
+        data = {"topic": pk, "auth_token": self.request.data['auth_token']}
+        serializer = self.get_serializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        if not serializer.created:
+            return Response(serializer.data, status=status.HTTP_200_OK)
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
-class CategoryViewSet(NestedViewSetMixin, viewsets.ModelViewSet):
+    @detail_route(methods=['post'])
+    def unfollow(self, request, pk):
+        data = {"topic": pk, "auth_token": self.request.data['auth_token']}
+        serializer = self.get_serializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        serializer.unfollow()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class CategoryViewSet(ConditionalGetMixin, CachedRetrieveMixin, StoryListVersionMixin, NestedViewSetMixin, viewsets.ModelViewSet):
+    cache_model_name = 'category'
     queryset = Category.objects.filter(story_count__gte=3)
     serializer_class = CategorySerializer
     permission_classes = (IsAdminOrReadOnly,)
 
-class CommentViewSet(NestedViewSetMixin, viewsets.ModelViewSet):
-    "API endpoint for comments"
+COMMENT_ORDERINGS = {
+    'new': ('-pub_date', '-id'),
+    'top': ('-upvote_count', '-pub_date', '-id'),
+    'promoted': ('-promoted', '-upvote_count', '-pub_date', '-id'),
+}
+
+class CommentViewSet(ConditionalGetMixin, MultiGetMixin, NestedViewSetMixin, viewsets.ModelViewSet):
+    "API endpoint for comments. Lists take ?ordering=top, new or promoted."
     permission_classes = (AllowAny,)
     serializer_class = CommentSerializer
-    queryset = Comment.objects.all()
+    queryset = Comment.objects.select_related('author__profile')
+    pagination_class = OffsetOrKeysetPagination
+    keyset_field = 'pub_date'
+    etag_fields = ('upvote_count', 'flag_count')
+
+    @conditional_get('list_validators')
+    def list(self, request, *args, **kwargs):
+        "Lists comments through the fast path (see stories2.fastpath)"
+        fields = sparse_fields(request, COMMENT_FIELDS)
+        queryset = comment_values(self.filter_queryset(self.get_queryset()), fields)
+        ordering = request.query_params.get('ordering')
+        if ordering is not None:
+            if ordering not in COMMENT_ORDERINGS:
+                raise ParseError("?ordering must be one of {}".format(", ".join(sorted(COMMENT_ORDERINGS))))
+            if ordering != 'new' and keyset_requested(request):
+                raise ParseError("Cursor pagination only supports ?ordering=new")
+            queryset = queryset.order_by(*COMMENT_ORDERINGS[ordering])
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(represent_comments(page, fields))
+        return Response(represent_comments(list(queryset), fields))
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -88,6 +447,8 @@ class CommentViewSet(NestedViewSetMixin, viewsets.ModelViewSet):
         serializer = self.get_serializer(data=data)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        if not serializer.created:
+            return Response(serializer.data, status=status.HTTP_200_OK)
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
@@ -97,10 +458,27 @@ class CommentViewSet(NestedViewSetMixin, viewsets.ModelViewSet):
         serializer = self.get_serializer(data=data)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        if not serializer.created:
+            return Response(serializer.data, status=status.HTTP_200_OK)
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
-class FlaggedViewSet(NestedViewSetMixin, viewsets.ModelViewSet):
-    queryset = Comment.objects.annotate(flag_count=Count('flags')).filter(flag_count__gt=0).all()
+class ActionViewSet(viewsets.GenericViewSet):
+    """
+    Replays a queue of likes, upvotes and flags in one request: POST an auth_token and a list
+    of actions such as {"type": "like_story", "id": 5}. Returns a result for each action.
+    """
+    serializer_class = AuthTokenActionsSerializer
+    permission_classes = (AllowAny,)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response({'results': serializer.results}, status=status.HTTP_200_OK)
+
+class FlaggedViewSet(ConditionalGetMixin, NestedViewSetMixin, viewsets.ModelViewSet):
+    queryset = Comment.objects.filter(flag_count__gt=0).select_related('author__profile')
     serializer_class = CommentSerializer
+    etag_fields = ('upvote_count', 'flag_count')
     permission_classes = (IsAuthenticated,)